@@ -0,0 +1,121 @@
+"""Connection-scaling benchmark for the serving engines.
+
+Starts each engine on localhost, opens N concurrent Modbus TCP clients and
+has every client issue sequential FC3 reads. Reports connect time,
+aggregate requests/s and mean latency per engine and connection count.
+
+    python benchmarks/bench_connections.py --connections 10,100,1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from sim_engine import ENGINES, create_server
+
+
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_context(slave_id, count):
+    # ModbusSlaveContext shifts request addresses by one, hence the extra slot.
+    count += 1
+    block = ModbusSequentialDataBlock(0, list(range(count)))
+    slave = ModbusSlaveContext(co=ModbusSequentialDataBlock(0, [False] * count),
+                               di=ModbusSequentialDataBlock(0, [False] * count),
+                               hr=block, ir=block)
+    return ModbusServerContext(slaves={slave_id: slave}, single=False)
+
+
+async def client(port, slave_id, requests, quantity, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for tid in range(requests):
+            frame = struct.pack(">HHHBBHH", tid, 0, 6, slave_id, 3, 0, quantity)
+            t0 = time.perf_counter()
+            writer.write(frame)
+            header = await reader.readexactly(6)
+            length = struct.unpack(">H", header[4:6])[0]
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        writer.close()
+
+
+async def run_clients(port, slave_id, connections, requests, quantity):
+    latencies = []
+    t0 = time.perf_counter()
+    outcomes = await asyncio.gather(*(client(port, slave_id, requests, quantity, latencies)
+                                      for _ in range(connections)),
+                                    return_exceptions=True)
+    failed = sum(1 for o in outcomes if isinstance(o, Exception))
+    return time.perf_counter() - t0, latencies, failed
+
+
+def bench(engine, connections, requests, quantity):
+    port = free_port()
+    server = create_server(engine, make_context(1, quantity), ("127.0.0.1", port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    try:
+        elapsed, latencies, failed = asyncio.run(run_clients(port, 1, connections, requests, quantity))
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join(5)
+    done = len(latencies)
+    return {
+        "engine": engine,
+        "connections": connections,
+        "failed_connections": failed,
+        "requests": done,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(done / elapsed, 1) if elapsed else 0.0,
+        "mean_latency_ms": round(1000 * sum(latencies) / done, 3) if done else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--connections", default="10,100,500")
+    parser.add_argument("--requests", type=int, default=50, help="requests per connection")
+    parser.add_argument("--quantity", type=int, default=10, help="registers per read")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    raise_fd_limit()
+    results = []
+    for count in [int(c) for c in args.connections.split(",")]:
+        for engine in args.engines.split(","):
+            result = bench(engine, count, args.requests, args.quantity)
+            print(json.dumps(result))
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
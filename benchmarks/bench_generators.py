@@ -0,0 +1,55 @@
+"""Throughput benchmark for the value generators.
+
+Runs every registered generator over a word (and bit) table of --size
+addresses for --ticks ticks and reports generated values per second.
+
+    python benchmarks/bench_generators.py --size 65536 --ticks 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim_datastore import BIT, WORD
+from sim_generators import GENERATORS, create_generator
+
+
+def bench(name, dtype, size, ticks, seed):
+    generator = create_generator({"type": name}, size, dtype, np.random.default_rng(seed))
+    out = np.zeros(size, dtype=dtype)
+    t0 = time.perf_counter()
+    for tick in range(ticks):
+        generator.generate(tick, tick * 0.1, out)
+    elapsed = time.perf_counter() - t0
+    return {
+        "generator": name,
+        "dtype": np.dtype(dtype).name,
+        "size": size,
+        "ticks": ticks,
+        "seconds": round(elapsed, 4),
+        "values_per_sec": round(size * ticks / elapsed) if elapsed else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=65536)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = []
+    for dtype in (WORD, BIT):
+        for name in sorted(GENERATORS):
+            result = bench(name, dtype, args.size, args.ticks, args.seed)
+            print(json.dumps(result))
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Load-generating Modbus TCP client benchmark.
+
+Drives a simulator on localhost with many client connections issuing a
+weighted mix of function codes, optionally pipelined, and prints one JSON
+object with throughput and p50/p99/p999 latency (overall and per function
+code). Without --target a headless simulator is started for the run.
+
+    python benchmarks/bench_load.py --connections 100 --mix 3:80,4:10,16:10
+    python benchmarks/bench_load.py --target 127.0.0.1:5020 --depth 8 --sizes 1,10,125
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Largest quantity per request of each function code (Modbus spec).
+MAX_QUANTITY = {1: 2000, 2: 2000, 3: 125, 4: 125, 5: 1, 6: 1, 15: 1968, 16: 123}
+
+
+def parse_mix(text):
+    # "3:70,4:20,16:10" -> [(3, 70.0), (4, 20.0), (16, 10.0)]
+    mix = []
+    for item in text.split(","):
+        fc, _, weight = item.partition(":")
+        fc = int(fc)
+        if fc not in MAX_QUANTITY:
+            raise argparse.ArgumentTypeError("unsupported function code %d" % fc)
+        mix.append((fc, float(weight or 1)))
+    return mix
+
+
+def build_request(tid, unit, fc, address, quantity):
+    # One MBAP frame for function code fc.
+    if fc in (1, 2, 3, 4):
+        pdu = struct.pack(">BHH", fc, address, quantity)
+    elif fc == 5:
+        pdu = struct.pack(">BHH", fc, address, 0xFF00)
+    elif fc == 6:
+        pdu = struct.pack(">BHH", fc, address, tid & 0x7FFF)
+    elif fc == 15:
+        data = bytes((quantity + 7) // 8)
+        pdu = struct.pack(">BHHB", fc, address, quantity, len(data)) + data
+    else:
+        data = struct.pack(">%dH" % quantity, *([tid & 0x7FFF] * quantity))
+        pdu = struct.pack(">BHHB", fc, address, quantity, len(data)) + data
+    return struct.pack(">HHHB", tid, 0, len(pdu) + 1, unit) + pdu
+
+
+class Connection(object):
+    # One client connection keeping up to `depth` requests in flight,
+    # matched to their responses by transaction id.
+
+    def __init__(self, options, rng, deadline):
+        self.options = options
+        self.rng = rng
+        self.deadline = deadline
+        self.codes = [fc for fc, _ in options.mix]
+        self.weights = [weight for _, weight in options.mix]
+        self.pending = {}           # {tid: (function code, start time)}
+        self.latencies = {}         # {function code: [seconds]}
+        self.exceptions = 0
+        self._tid = 0
+
+    def next_request(self):
+        fc = self.rng.choices(self.codes, self.weights)[0]
+        quantity = min(self.rng.choice(self.options.sizes), MAX_QUANTITY[fc], self.options.span)
+        address = self.options.start + self.rng.randint(0, max(self.options.span - quantity, 0))
+        self._tid = (self._tid + 1) & 0xFFFF
+        return self._tid, fc, build_request(self._tid, self.options.unit, fc, address, quantity)
+
+    async def run(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        window = asyncio.Semaphore(self.options.depth)
+        sender = asyncio.ensure_future(self.send(writer, window))
+        try:
+            while time.monotonic() < self.deadline or self.pending:
+                if not self.pending:
+                    if sender.done():
+                        break
+                    await asyncio.sleep(0.001)
+                    continue
+                header = await reader.readexactly(7)
+                tid, _, length, _ = struct.unpack(">HHHB", header)
+                body = await reader.readexactly(length - 1)
+                sent = self.pending.pop(tid, None)
+                if sent is None:
+                    continue
+                fc, t0 = sent
+                self.latencies.setdefault(fc, []).append(time.perf_counter() - t0)
+                if body[0] & 0x80:
+                    self.exceptions += 1
+                window.release()
+        finally:
+            sender.cancel()
+            writer.close()
+
+    async def send(self, writer, window):
+        while time.monotonic() < self.deadline:
+            await window.acquire()
+            tid, fc, frame = self.next_request()
+            self.pending[tid] = (fc, time.perf_counter())
+            writer.write(frame)
+            await writer.drain()
+
+
+def load_process(options, index, results):
+    # Run options.connections connections in one event loop; report the
+    # latencies per function code as float64 arrays.
+    async def run():
+        deadline = time.monotonic() + options.duration
+        connections = [Connection(options, random.Random(options.seed * 1000003 + index * 1009 + i),
+                                  deadline) for i in range(options.connections)]
+        outcomes = await asyncio.gather(*(c.run(options.host, options.port) for c in connections),
+                                        return_exceptions=True)
+        latencies = {}
+        for connection in connections:
+            for fc, values in connection.latencies.items():
+                latencies.setdefault(fc, []).extend(values)
+        return {
+            "latencies": {fc: np.array(values).tobytes() for fc, values in latencies.items()},
+            "exceptions": sum(c.exceptions for c in connections),
+            "failed_connections": sum(1 for o in outcomes if isinstance(o, Exception)),
+        }
+    results.put(asyncio.run(run()))
+
+
+def percentiles(values):
+    if not len(values):
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "p999_ms": 0.0, "mean_ms": 0.0}
+    p50, p99, p999 = np.percentile(values, [50, 99, 99.9]) * 1000
+    return {"p50_ms": round(p50, 3), "p99_ms": round(p99, 3), "p999_ms": round(p999, 3),
+            "mean_ms": round(float(values.mean()) * 1000, 3)}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_simulator(options):
+    # Headless simulator sized for the requested address span.
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, "sim_headless.py"),
+               "--ip", "127.0.0.1", "--port", str(port), "--engine", options.engine,
+               "--interval", str(options.interval), "--log-level", "WARNING"]
+    for table in ("coils", "discrete", "holding", "input"):
+        command += ["--" + table, "%d:%d" % (options.start, options.span)]
+    if options.workers:
+        command += ["--workers", str(options.workers)]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("simulator did not start")
+            time.sleep(0.1)
+
+
+def run(options):
+    process = None
+    if options.target:
+        host, _, port = options.target.rpartition(":")
+        options.host, options.port = host or "127.0.0.1", int(port)
+    else:
+        process, options.port = start_simulator(options)
+        options.host = "127.0.0.1"
+    try:
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        loaders = [context.Process(target=load_process, args=(options, index, results))
+                   for index in range(options.client_processes)]
+        for loader in loaders:
+            loader.start()
+        outcomes = [results.get() for _ in loaders]
+        for loader in loaders:
+            loader.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    by_function = {}
+    for outcome in outcomes:
+        for fc, data in outcome["latencies"].items():
+            by_function.setdefault(fc, []).append(np.frombuffer(data))
+    by_function = {fc: np.concatenate(parts) for fc, parts in sorted(by_function.items())}
+    everything = np.concatenate(list(by_function.values())) if by_function else np.zeros(0)
+    result = {
+        "target": "%s:%d" % (options.host, options.port),
+        "engine": None if options.target else options.engine,
+        "connections": options.connections * options.client_processes,
+        "depth": options.depth,
+        "mix": {str(fc): weight for fc, weight in options.mix},
+        "sizes": options.sizes,
+        "seconds": options.duration,
+        "requests": int(len(everything)),
+        "requests_per_sec": round(len(everything) / options.duration, 1),
+        "exceptions": sum(o["exceptions"] for o in outcomes),
+        "failed_connections": sum(o["failed_connections"] for o in outcomes),
+    }
+    result.update(percentiles(everything))
+    result["by_function"] = {str(fc): dict(requests=int(len(values)), **percentiles(values))
+                             for fc, values in by_function.items()}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", help="HOST:PORT of a running simulator")
+    parser.add_argument("--engine", default="asyncio", help="engine of the started simulator")
+    parser.add_argument("--workers", type=int, help="worker processes of the started simulator")
+    parser.add_argument("--interval", type=float, default=1.0, help="update interval of the started simulator")
+    parser.add_argument("--unit", type=int, default=1, help="slave id")
+    parser.add_argument("--connections", type=int, default=50, help="connections per client process")
+    parser.add_argument("--client-processes", type=int, default=1)
+    parser.add_argument("--depth", type=int, default=1, help="requests in flight per connection")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("3:100"),
+                        help="weighted function codes, e.g. 3:70,4:20,16:10")
+    parser.add_argument("--sizes", type=lambda s: [int(v) for v in s.split(",")], default=[10],
+                        help="read/write quantities picked at random, e.g. 1,10,125")
+    parser.add_argument("--start", type=int, default=0, help="first address used")
+    parser.add_argument("--span", type=int, default=1000, help="addresses used from --start")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    options = parser.parse_args(argv)
+    result = run(options)
+    text = json.dumps(result)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Tick cost benchmark for scenarios.
+
+Builds a device with a --size word table in random mode and measures the
+mean update_registers() time without a scenario and with one scripting
+--points addresses (half ramps, half set values, and --latches latched
+alarms), plus the time to compile the scenario.
+
+    python benchmarks/bench_scenario.py --size 65536 --points 5000 --latches 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim_config import parse_config
+from sim_server import SimDevice
+
+
+def scenario_events(points, latches, size):
+    events = []
+    for i in range(points):
+        address = (i * 7) % size
+        if i % 2:
+            events.append({"at": i % 30, "table": "holding", "address": address,
+                           "ramp": [0, 1000], "duration": 10 + i % 20})
+        else:
+            events.append({"at": i % 30, "table": "holding", "address": address, "set": i % 1000})
+    for i in range(latches):
+        events.append({"table": "holding", "address": size - 1 - i, "latch": 1,
+                       "when": "holding %d >= 900" % ((i * 14 + 1) % size)})
+    return events
+
+
+def mean_tick(device, ticks):
+    started = time.perf_counter()
+    for _ in range(ticks):
+        device.update_registers()
+    return (time.perf_counter() - started) / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=65536, help="holding registers")
+    parser.add_argument("--points", type=int, default=5000, help="scripted addresses")
+    parser.add_argument("--latches", type=int, default=500, help="latched alarms")
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+    raw = {"registers": {name: {"start": 0, "count": 0} for name in ("coils", "discrete", "input")},
+           "add_extra_count": False, "seed": 0, "update_interval": 0.1}
+    raw["registers"]["holding"] = {"start": 0, "count": args.size}
+    plain = SimDevice(parse_config(raw))
+    raw["scenario"] = {"events": scenario_events(args.points, args.latches, args.size)}
+    config = parse_config(raw)
+    started = time.perf_counter()
+    scripted = SimDevice(config)
+    compile_seconds = time.perf_counter() - started
+    result = {
+        "size": args.size,
+        "points": args.points,
+        "latches": args.latches,
+        "ticks": args.ticks,
+        "compile_ms": round(compile_seconds * 1000, 2),
+        "tick_ms": round(mean_tick(plain, args.ticks) * 1000, 4),
+        "tick_with_scenario_ms": round(mean_tick(scripted, args.ticks) * 1000, 4),
+    }
+    print(json.dumps(result))
+    return result
+
+
+if __name__ == "__main__":
+    main()
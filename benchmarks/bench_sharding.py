@@ -0,0 +1,129 @@
+"""Core-scaling benchmark for sharded mode.
+
+Serves --ports ports (one slave each) from a ShardedSimulator with 1, 2,
+4, ... worker processes and drives them with --client-processes load
+processes of asyncio clients issuing sequential FC3 reads for --duration
+seconds. Reports aggregate requests/s and the speedup over one worker.
+
+    python benchmarks/bench_sharding.py --workers 1,2,4 --ports 8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim_config import parse_config
+from sim_shard import ShardedSimulator
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_ports(ports, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("port %d did not come up" % port)
+                time.sleep(0.1)
+
+
+async def client(port, deadline, quantity):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    done = 0
+    try:
+        while time.monotonic() < deadline:
+            writer.write(struct.pack(">HHHBBHH", done & 0xFFFF, 0, 6, 1, 3, 0, quantity))
+            header = await reader.readexactly(6)
+            await reader.readexactly(struct.unpack(">H", header[4:6])[0])
+            done += 1
+    finally:
+        writer.close()
+    return done
+
+
+def load_process(ports, connections, duration, quantity, results):
+    async def run():
+        deadline = time.monotonic() + duration
+        counts = await asyncio.gather(*(client(ports[i % len(ports)], deadline, quantity)
+                                        for i in range(connections)))
+        return sum(counts)
+    results.put(asyncio.run(run()))
+
+
+def bench(workers, ports, client_processes, connections, duration, quantity):
+    port_numbers = [free_port() for _ in range(ports)]
+    configs = [parse_config({"ip": "127.0.0.1", "port": port, "update_interval": 0.1,
+                             "registers": {"holding": {"start": 0, "count": max(quantity, 100)}}})
+               for port in port_numbers]
+    simulator = ShardedSimulator(configs, workers)
+    thread = threading.Thread(target=simulator.serve_forever)
+    thread.start()
+    try:
+        wait_for_ports(port_numbers)
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        loaders = []
+        for index in range(client_processes):
+            mine = port_numbers[index::client_processes] or port_numbers
+            loaders.append(context.Process(target=load_process,
+                                           args=(mine, connections, duration, quantity, results)))
+        for loader in loaders:
+            loader.start()
+        total = sum(results.get() for _ in loaders)
+        for loader in loaders:
+            loader.join()
+    finally:
+        simulator.stop()
+        thread.join()
+    return {
+        "workers": len(simulator.groups),
+        "ports": ports,
+        "client_processes": client_processes,
+        "connections_per_process": connections,
+        "requests": total,
+        "seconds": duration,
+        "requests_per_sec": round(total / duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--ports", type=int, default=8)
+    parser.add_argument("--client-processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--connections", type=int, default=16, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of load per run")
+    parser.add_argument("--quantity", type=int, default=10, help="registers per read")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        result = bench(workers, args.ports, args.client_processes, args.connections,
+                       args.duration, args.quantity)
+        if results:
+            result["speedup"] = round(result["requests_per_sec"] / results[0]["requests_per_sec"], 2)
+        print(json.dumps(result))
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main()
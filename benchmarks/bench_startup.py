@@ -0,0 +1,119 @@
+"""Startup time benchmark.
+
+Measures, over --runs fresh processes each, the import time of the entry
+modules and the time from launching a simulator to its first answered
+read (FC3), and prints one JSON object with the median and worst times.
+The simulator is the headless source run unless --command gives another
+launch command, e.g. a frozen (PyInstaller) build; "{port}" in it is
+replaced by the port to listen on.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --command "dist/sim_headless --port {port} --ip 127.0.0.1"
+"""
+import argparse
+import json
+import os
+import shlex
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_MODULES = ("sim_headless", "sim_server", "slaveTCPsim")
+
+# Read Holding Registers, transaction 1, unit 1, address 0, quantity 1.
+READ_REQUEST = struct.pack(">HHHBBHH", 1, 0, 6, 1, 3, 0, 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(module):
+    # Seconds to import module in a fresh interpreter, measured inside it
+    # so interpreter startup is not counted.
+    code = ("import time; t = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - t)" % module)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT,
+                                     stderr=subprocess.DEVNULL)
+    return float(output.split()[-1])
+
+
+def first_response(port, deadline):
+    # Poll the port with a read until a full response arrives.
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), 0.5) as s:
+                s.settimeout(1.0)
+                s.sendall(READ_REQUEST)
+                response = s.recv(256)
+                if len(response) >= 9 and response[7] == 3:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.002)
+    return False
+
+
+def time_to_first_request(command, timeout):
+    port = free_port()
+    argv = [part.replace("{port}", str(port)) for part in command]
+    started = time.perf_counter()
+    process = subprocess.Popen(argv, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not first_response(port, started + timeout):
+            raise RuntimeError("simulator did not answer within %.0f s: %s" % (timeout, " ".join(argv)))
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summary(samples):
+    return {"median_ms": round(statistics.median(samples) * 1000, 1),
+            "max_ms": round(max(samples) * 1000, 1)}
+
+
+def run(options):
+    if options.command:
+        command = shlex.split(options.command)
+    else:
+        command = [sys.executable, os.path.join(ROOT, "sim_headless.py"), "--ip", "127.0.0.1",
+                   "--port", "{port}", "--engine", options.engine, "--log-level", "WARNING"]
+    result = {"runs": options.runs, "command": " ".join(command)}
+    if not options.skip_imports:
+        result["imports"] = {module: summary([import_time(module) for _ in range(options.runs)])
+                             for module in options.modules}
+    result["first_request"] = summary([time_to_first_request(command, options.timeout)
+                                       for _ in range(options.runs)])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="processes started per measurement")
+    parser.add_argument("--engine", default="threaded", help="engine of the started source simulator")
+    parser.add_argument("--command", help='launch command of the simulator, with "{port}" for its port')
+    parser.add_argument("--modules", type=lambda s: s.split(","), default=list(ENTRY_MODULES),
+                        help="entry modules whose import time is measured")
+    parser.add_argument("--skip-imports", action="store_true", help="only measure the first request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the first answer")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    options = parser.parse_args(argv)
+    result = run(options)
+    text = json.dumps(result)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
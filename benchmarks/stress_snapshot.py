@@ -0,0 +1,91 @@
+"""Tick-consistency stress test for the snapshot store.
+
+Runs one device in incremental mode, where every holding and input
+register of a tick holds the same value, and regenerates it as fast as
+possible while reader threads hammer it:
+
+- block readers call getValues() like the request handlers and check that
+  every value of a read belongs to one tick;
+- snapshot readers call store.snapshot() and also check that holding and
+  input registers come from the same tick.
+
+Exits non-zero if any torn read is seen.
+
+    python benchmarks/stress_snapshot.py --seconds 5 --readers 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim_config import parse_config
+from sim_server import SimDevice
+
+
+def block_reader(device, stop, stats):
+    start, count = device.config.tables["holding"].segments[0]
+    while not stop.is_set():
+        values = device.holding_registers.getValues(start, count)
+        stats["reads"] += 1
+        if min(values) != max(values):
+            stats["torn"] += 1
+
+
+def snapshot_reader(device, stop, stats):
+    while not stop.is_set():
+        _, tables = device.store.snapshot()
+        holding, inputs = tables["holding"], tables["input"]
+        stats["reads"] += 1
+        if holding.min() != holding.max() or inputs.min() != inputs.max() or holding[0] != inputs[0]:
+            stats["torn"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=4, help="threads of each reader kind")
+    parser.add_argument("--registers", type=int, default=10000)
+    args = parser.parse_args()
+
+    config = parse_config({
+        "registers": {"holding": {"start": 0, "count": args.registers},
+                      "input": {"start": 0, "count": args.registers}},
+        "word_mode": "incremental",
+        "add_extra_count": False,
+    })
+    device = SimDevice(config)
+    device.update_registers()
+    stop = threading.Event()
+    stats = {}
+    threads = []
+    for kind, target in (("block", block_reader), ("snapshot", snapshot_reader)):
+        for i in range(args.readers):
+            stats["%s-%d" % (kind, i)] = {"reads": 0, "torn": 0}
+            threads.append(threading.Thread(target=target, args=(device, stop, stats["%s-%d" % (kind, i)])))
+    for thread in threads:
+        thread.start()
+
+    ticks = 0
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        device.update_registers()
+        ticks += 1
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    torn = sum(s["torn"] for s in stats.values())
+    print(json.dumps({
+        "ticks": ticks,
+        "reads": sum(s["reads"] for s in stats.values()),
+        "torn_reads": torn,
+    }))
+    return 1 if torn else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
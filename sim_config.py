@@ -0,0 +1,430 @@
+import json
+import os
+from dataclasses import dataclass, field
+
+from sim_scheduler import DEFAULT_POLICY, POLICIES
+
+# NumPy, pymodbus and the rest of the server core are imported where a
+# config is parsed, so the GUI can build its window without them.
+
+# Available serving engines (see sim_engine.py).
+# "threaded": pymodbus sync server, one thread per TCP client.
+# "asyncio":  every client is served from a single event loop.
+ENGINES = ("threaded", "asyncio")
+DEFAULT_ENGINE = "threaded"
+
+# Default cap on the requests of one connection that the server has taken
+# in but not yet answered. Pipelining clients may send several requests
+# (with different transaction IDs) before reading any response; up to this
+# many are executed back to back and answered with one vectored write, and
+# the others wait in the socket until those are answered.
+DEFAULT_MAX_INFLIGHT = 16
+
+# Register tables in display order, with the names used in error messages.
+TABLES = ("discrete", "coils", "holding", "input")
+TABLE_LABELS = {
+    "discrete": "Discrete Inputs",
+    "coils": "Coils",
+    "holding": "Holding Registers",
+    "input": "Input Registers",
+}
+WORD_MODES = ("random", "incremental", "inject")
+
+
+class ConfigError(ValueError):
+    # Raised with a user-facing message when a configuration value is invalid.
+    pass
+
+
+@dataclass
+class TableLayout:
+    # A contiguous table is one (start, count) segment; sparse tables list
+    # several. start/count describe the first segment.
+    start: int = 0
+    count: int = 1
+    segments: list = None
+
+    def __post_init__(self):
+        if self.segments is None:
+            self.segments = [(self.start, self.count)]
+        elif self.segments:
+            self.start, self.count = self.segments[0]
+
+
+@dataclass
+class SimConfig:
+    tables: dict = field(default_factory=lambda: {name: TableLayout() for name in TABLES})
+    ip: str = "localhost"
+    port: int = 502
+    slave_id: int = 1
+    update_interval: float = 1.0
+    word_mode: str = "random"
+    increment_step: int = 1
+    increment_start: int = 0
+    engine: str = DEFAULT_ENGINE
+    # Pipelined requests of one connection taken in but not yet answered.
+    max_inflight: int = DEFAULT_MAX_INFLIGHT
+    # Per-range value generators: {table: [{"type": ..., "start": ..., "count": ..., params}]}.
+    generators: dict = field(default_factory=dict)
+    # Seed for every random source of the device; None draws fresh entropy.
+    seed: int = None
+    # Local HTTP endpoint for /metrics and /metrics.json; None disables it.
+    metrics_port: int = None
+    metrics_ip: str = "127.0.0.1"
+    # Local HTTP/JSON control API (see sim_control.py); None disables it.
+    control_port: int = None
+    control_ip: str = "127.0.0.1"
+    # JSON-lines trace of served requests (see sim_logging.RequestTrace),
+    # on from startup; None leaves it off until enabled at runtime.
+    request_trace: str = None
+    # Update intervals overriding update_interval per table: {table: seconds}.
+    table_intervals: dict = field(default_factory=dict)
+    # Overrun handling ("skip" or "catch-up") and busy-wait margin in seconds
+    # of the tick scheduler; plant-wide, read from the first device.
+    scheduler_policy: str = DEFAULT_POLICY
+    scheduler_spin: float = 0.0
+    # Sparse updates: {table: rate} regenerates only part of a table per
+    # tick, a fraction (float, each address changes with that probability)
+    # or a fixed count of addresses (int). Other tables change completely.
+    change_rates: dict = field(default_factory=dict)
+    # Seconds a client write (FC5/6/15/16) overrides the generated value of
+    # a coil or holding register; None holds it until released, 0 lets the
+    # next tick overwrite it.
+    write_hold: float = None
+    # Scripted per-address behaviour over time (sim_scenario.Scenario),
+    # applied on top of the generators; None for none.
+    scenario: object = None
+    # Register trace to replay instead of the generators (for the tables it
+    # contains), at speed x real time, restarting at the end when looping.
+    # Paths may contain {port} and {slave_id}.
+    replay_file: str = None
+    replay_speed: float = 1.0
+    replay_loop: bool = True
+    # Register trace to record every published tick to.
+    record_file: str = None
+    # Plant state file (tables, injections, held writes, generator state)
+    # saved every state_interval seconds (0: on shutdown only) and restored
+    # on startup when state_restore is set; plant-wide, read from the
+    # first device.
+    state_file: str = None
+    state_interval: float = 60.0
+    state_restore: bool = True
+
+
+def parse_config(raw):
+    # Build a SimConfig from a plain dict, as produced by the GUI entries,
+    # the command line or a config file. Values may be strings or numbers:
+    #
+    #   {"registers": {"holding": {"start": 0, "count": 10},
+    #                  "input": {"segments": [[0, 100], [10000, 100]]}, ...},
+    #    "add_extra_count": True, "ip": "", "port": 502, "slave_id": 1,
+    #    "update_interval": 1, "word_mode": "random",
+    #    "increment_step": 1, "increment_start": 0, "engine": "threaded",
+    #    "seed": 42, "generators": {"holding": [
+    #        {"type": "sine", "start": 0, "count": 10, "period": 30}]},
+    #    "table_intervals": {"coils": 0.1}, "scheduler_policy": "skip",
+    #    "change_rates": {"holding": 0.05, "coils": 10}, "request_trace": "requests.jsonl",
+    #    "write_hold": "reset", "scenario": "trip.yaml",
+    #    "replay_file": "plant.mbt", "replay_speed": 10,
+    #    "record_file": "capture-{port}-{slave_id}.mbt", "state_file": "plant.state",
+    #    "state_interval": 60, "state_restore": True}
+    #
+    # Missing keys take the SimConfig defaults. "add_extra_count" (on by
+    # default) adds one to every table count, like the GUI checkbox.
+    config = SimConfig()
+    registers = raw.get("registers") or {}
+    extra = 1 if _parse_bool(raw.get("add_extra_count", True)) else 0
+    for name in TABLES:
+        table = registers.get(name) or {}
+        try:
+            layout = _parse_segments(table, extra)
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise ConfigError("Invalid %s configuration" % TABLE_LABELS[name])
+        config.tables[name] = TableLayout(segments=layout) if layout else TableLayout(count=0)
+
+    config.ip = str(raw.get("ip") or "").strip() or "localhost"
+    config.port = _parse_number(raw, "port", int, config.port, "Invalid port number")
+    config.update_interval = _parse_number(raw, "update_interval", float,
+                                           config.update_interval, "Invalid update interval")
+    config.slave_id = _parse_number(raw, "slave_id", int, config.slave_id, "Invalid Slave ID")
+    if not 0 <= config.slave_id <= 255:
+        raise ConfigError("Invalid Slave ID")
+    # Increment settings fall back to their defaults instead of failing.
+    try:
+        config.increment_step = int(raw.get("increment_step", config.increment_step))
+    except (TypeError, ValueError):
+        config.increment_step = 1
+    try:
+        config.increment_start = int(raw.get("increment_start", config.increment_start))
+    except (TypeError, ValueError):
+        config.increment_start = 0
+
+    config.word_mode = str(raw.get("word_mode", config.word_mode))
+    if config.word_mode not in WORD_MODES:
+        raise ConfigError("Invalid word mode: %s" % config.word_mode)
+    config.engine = str(raw.get("engine", config.engine))
+    if config.engine not in ENGINES:
+        raise ConfigError("Invalid server engine: %s" % config.engine)
+    config.max_inflight = _parse_number(raw, "max_inflight", int, config.max_inflight,
+                                        "Invalid in-flight request limit")
+    if config.max_inflight < 1:
+        raise ConfigError("Invalid in-flight request limit")
+    if raw.get("seed") is not None:
+        config.seed = _parse_number(raw, "seed", int, None, "Invalid seed")
+    config.generators = _parse_generators(raw.get("generators") or {})
+    if raw.get("metrics_port") not in (None, ""):
+        config.metrics_port = _parse_number(raw, "metrics_port", int, None, "Invalid metrics port")
+    config.metrics_ip = str(raw.get("metrics_ip") or config.metrics_ip)
+    if raw.get("control_port") not in (None, ""):
+        config.control_port = _parse_number(raw, "control_port", int, None, "Invalid control port")
+    config.control_ip = str(raw.get("control_ip") or config.control_ip)
+    config.request_trace = str(raw.get("request_trace") or "") or None
+    config.table_intervals = _parse_table_intervals(raw.get("table_intervals") or {})
+    config.change_rates = _parse_change_rates(raw.get("change_rates") or {})
+    config.scheduler_policy = str(raw.get("scheduler_policy", config.scheduler_policy))
+    if config.scheduler_policy not in POLICIES:
+        raise ConfigError("Invalid scheduler policy: %s" % config.scheduler_policy)
+    config.scheduler_spin = _parse_number(raw, "scheduler_spin", float, config.scheduler_spin,
+                                          "Invalid scheduler spin time")
+    if config.scheduler_spin < 0:
+        raise ConfigError("Invalid scheduler spin time")
+    config.write_hold = _parse_write_hold(raw.get("write_hold"))
+    config.scenario = _parse_scenario(raw.get("scenario"))
+    config.replay_file = str(raw.get("replay_file") or "") or None
+    config.replay_speed = _parse_number(raw, "replay_speed", float, config.replay_speed,
+                                        "Invalid replay speed")
+    if config.replay_speed <= 0:
+        raise ConfigError("Invalid replay speed")
+    config.replay_loop = _parse_bool(raw.get("replay_loop", config.replay_loop))
+    config.record_file = str(raw.get("record_file") or "") or None
+    config.state_file = str(raw.get("state_file") or "") or None
+    config.state_interval = _parse_number(raw, "state_interval", float, config.state_interval,
+                                          "Invalid state save interval")
+    if config.state_interval < 0:
+        raise ConfigError("Invalid state save interval")
+    config.state_restore = _parse_bool(raw.get("state_restore", config.state_restore))
+    return config
+
+
+def _parse_change_rates(raw):
+    # {table: rate}: "5%" or a number below 1 is a fraction, a whole number
+    # of at least 1 is a count of addresses per tick.
+    if not isinstance(raw, dict):
+        raise ConfigError("change_rates must map table names to rates")
+    rates = {}
+    for name, value in raw.items():
+        if name not in TABLES:
+            raise ConfigError("Invalid table in change_rates: %s" % name)
+        text = str(value).strip()
+        try:
+            if text.endswith("%"):
+                rate = float(text[:-1]) / 100.0
+            elif isinstance(value, int) or text.isdigit():
+                rate = int(text)
+            else:
+                rate = float(text)
+        except ValueError:
+            rate = -1
+        if (isinstance(rate, float) and not 0.0 <= rate <= 1.0) or rate < 0:
+            raise ConfigError("Invalid %s change rate" % TABLE_LABELS[name])
+        rates[name] = rate
+    return rates
+
+
+def _parse_write_hold(value):
+    # None, "" or "reset" -> None (hold until released); "off" -> 0;
+    # otherwise a number of seconds >= 0.
+    if value is None or str(value).strip().lower() in ("", "reset"):
+        return None
+    if str(value).strip().lower() == "off":
+        return 0.0
+    try:
+        hold = float(value)
+    except (TypeError, ValueError):
+        hold = -1.0
+    if hold < 0:
+        raise ConfigError("Invalid write hold time")
+    return hold
+
+
+def _parse_table_intervals(raw):
+    # {table: seconds}; every interval must be a positive number.
+    if not isinstance(raw, dict):
+        raise ConfigError("table_intervals must map table names to seconds")
+    intervals = {}
+    for name, value in raw.items():
+        if name not in TABLES:
+            raise ConfigError("Invalid table in table_intervals: %s" % name)
+        try:
+            interval = float(value)
+        except (TypeError, ValueError):
+            interval = 0.0
+        if interval <= 0:
+            raise ConfigError("Invalid %s update interval" % TABLE_LABELS[name])
+        intervals[name] = interval
+    return intervals
+
+
+def _parse_scenario(raw):
+    # A scenario file path or an inline {"events": [...]} mapping. A file
+    # may also be a whole config with the scenario under "scenario".
+    if raw in (None, ""):
+        return None
+    from sim_scenario import Scenario, parse_scenario
+    if isinstance(raw, Scenario):
+        return raw
+    if isinstance(raw, str):
+        raw = load_config_file(os.path.expanduser(raw))
+        if isinstance(raw, dict) and isinstance(raw.get("scenario"), dict):
+            raw = raw["scenario"]
+    return parse_scenario(raw)
+
+
+def _parse_generators(raw):
+    # {table: [spec, ...]}: check every spec names a known generator with
+    # valid parameters and an address range.
+    import numpy as np
+    from sim_datastore import BIT, WORD
+    from sim_generators import create_generator
+    generators = {}
+    if not isinstance(raw, dict):
+        raise ConfigError("generators must map table names to lists")
+    for name, specs in raw.items():
+        if name not in TABLES or not isinstance(specs, list):
+            raise ConfigError("Invalid generators for table %s" % name)
+        dtype = BIT if name in ("coils", "discrete") else WORD
+        parsed = []
+        for spec in specs:
+            try:
+                spec = dict(spec)
+                spec["start"] = int(spec.get("start", 0))
+                spec["count"] = int(spec.get("count", 1))
+                create_generator(spec, 1, dtype, np.random.default_rng(0))
+            except (TypeError, ValueError) as e:
+                raise ConfigError("Invalid %s generator %s: %s" % (TABLE_LABELS[name], spec, e))
+            parsed.append(spec)
+        generators[name] = parsed
+    return generators
+
+
+def parse_devices(raw):
+    # Build one SimConfig per simulated slave. Without a "devices" list the
+    # raw dict describes a single slave (see parse_config). With one, every
+    # entry is merged over the top-level keys, which act as defaults:
+    #
+    #   {"port": 502, "registers": {...},
+    #    "devices": [{"slave_ids": "1-100"},
+    #                {"port": 1502, "slave_id": 7, "word_mode": "incremental"}]}
+    #
+    # "slave_ids" (a list of ids and/or "first-last" ranges, or one range
+    # string) expands an entry into one slave per id with the same layout.
+    # Slaves sharing an ip/port are served behind that one port.
+    devices = raw.get("devices")
+    if not devices:
+        return [parse_config(raw)]
+    if not isinstance(devices, list):
+        raise ConfigError("devices must be a list")
+    defaults = {key: value for key, value in raw.items() if key != "devices"}
+    configs = []
+    endpoints = {}
+    for device in devices:
+        if not isinstance(device, dict):
+            raise ConfigError("Each device must be a mapping")
+        merged = dict(defaults)
+        merged.update(device)
+        registers = dict(defaults.get("registers") or {})
+        registers.update(device.get("registers") or {})
+        merged["registers"] = registers
+        slave_ids = merged.pop("slave_ids", None)
+        for slave_id in _parse_slave_ids(slave_ids) if slave_ids is not None else [merged.get("slave_id", 1)]:
+            merged["slave_id"] = slave_id
+            config = parse_config(merged)
+            key = (config.ip, config.port)
+            endpoint = endpoints.setdefault(key, {"engine": config.engine, "slaves": set()})
+            if config.slave_id in endpoint["slaves"]:
+                raise ConfigError("Duplicate Slave ID %s on %s:%s" % (config.slave_id, config.ip, config.port))
+            if config.engine != endpoint["engine"]:
+                raise ConfigError("Conflicting server engines on %s:%s" % key)
+            endpoint["slaves"].add(config.slave_id)
+            configs.append(config)
+    return configs
+
+
+def _parse_slave_ids(value):
+    items = value if isinstance(value, list) else [value]
+    slave_ids = []
+    try:
+        for item in items:
+            if isinstance(item, str) and "-" in item:
+                first, last = item.split("-")
+                slave_ids.extend(range(int(first), int(last) + 1))
+            else:
+                slave_ids.append(int(item))
+    except (TypeError, ValueError):
+        raise ConfigError("Invalid slave_ids: %s" % (value,))
+    return slave_ids
+
+
+def _parse_segments(table, extra):
+    # A table is either {"start": S, "count": N} or {"segments": [...]},
+    # each segment being [S, N] or {"start": S, "count": N}. Returns the
+    # merged (start, count) list, each segment padded by extra.
+    from sim_datastore import merge_segments
+    segments = table.get("segments")
+    if segments is None:
+        start, count = int(table.get("start", 0)), int(table.get("count", 1))
+        if start < 0 or count < 0:
+            raise ValueError("negative table layout")
+        return merge_segments([(start, count + extra)])
+    layout = []
+    for segment in segments:
+        if isinstance(segment, dict):
+            start, count = int(segment["start"]), int(segment["count"])
+        else:
+            start, count = int(segment[0]), int(segment[1])
+        layout.append((start, count))
+    # Pad after merging so adjacent segments do not overlap.
+    return merge_segments([(start, count + extra) for start, count in merge_segments(layout)])
+
+
+def _parse_number(raw, key, kind, default, message):
+    try:
+        return kind(raw.get(key, default))
+    except (TypeError, ValueError):
+        raise ConfigError(message)
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def load_config_file(path):
+    # Read a raw config dict from a JSON, TOML or YAML file (by extension).
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == ".json":
+            with open(path, "r") as f:
+                raw = json.load(f)
+        elif ext == ".toml":
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+            with open(path, "rb") as f:
+                raw = tomllib.load(f)
+        elif ext in (".yaml", ".yml"):
+            import yaml
+            with open(path, "r") as f:
+                raw = yaml.safe_load(f)
+        else:
+            raise ConfigError("Unsupported config file type: %s" % path)
+    except ConfigError:
+        raise
+    except Exception as e:
+        # Missing parser module, unreadable file or malformed content.
+        raise ConfigError("Cannot read %s: %s" % (path, e))
+    if not isinstance(raw, dict):
+        raise ConfigError("Config file %s must contain a mapping" % path)
+    return raw
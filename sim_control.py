@@ -0,0 +1,245 @@
+import collections
+import dataclasses
+import functools
+import threading
+
+from sim_config import TABLES, WORD_MODES
+from sim_datastore import BIT
+from sim_injection import TABLE_ALIASES
+from sim_logging import set_level
+from sim_state import device_key
+
+# Seconds an HTTP request waits for the update loop to run its commands.
+COMMAND_TIMEOUT = 10.0
+
+
+class ControlError(ValueError):
+    pass
+
+
+class ControlCommand(object):
+    # One queued command; the submitting thread waits on `done`.
+    __slots__ = ("name", "args", "result", "error", "done")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class CommandQueue(object):
+    # Commands from any thread, executed by the update thread between ticks
+    # (drain() runs before every tick), so control never races generation
+    # and the update loop never waits for its callers.
+
+    def __init__(self, devices, request_trace=None):
+        self.devices = devices
+        self.commands = dict(COMMANDS)
+        if request_trace is not None:
+            self.commands["trace"] = functools.partial(_trace, request_trace)
+        self._pending = collections.deque()
+
+    def submit(self, commands, timeout=COMMAND_TIMEOUT):
+        # Queue [{"command": name, ...}, ...] and wait for the results; all
+        # of them run in the same drain, i.e. between the same two ticks.
+        queued = []
+        for args in commands:
+            name = args.get("command") if isinstance(args, dict) else None
+            if name not in self.commands:
+                raise ControlError("Unknown command: %s" % name)
+            queued.append(ControlCommand(name, args))
+        self._pending.append(queued)
+        results = []
+        for command in queued:
+            if not command.done.wait(timeout):
+                raise ControlError("Timed out waiting for the update loop")
+            if command.error is not None:
+                raise command.error
+            results.append(command.result)
+        return results
+
+    def drain(self):
+        # Run every queued command; returns the number run.
+        count = 0
+        while self._pending:
+            batch = self._pending.popleft()
+            for command in batch:
+                try:
+                    command.result = self.commands[command.name](self.devices, command.args)
+                except Exception as e:
+                    # Any failure is the caller's: it must neither kill the
+                    # update thread nor leave the caller waiting.
+                    command.error = e if isinstance(e, ControlError) else ControlError(
+                        "%s: invalid arguments (%s: %s)" % (command.name, type(e).__name__, e))
+                finally:
+                    command.done.set()
+                count += 1
+        return count
+
+
+def _devices(devices, args):
+    # The devices a command addresses: "device" is "ip:port/slave" or a
+    # slave ID; without it every device.
+    wanted = args.get("device")
+    if wanted is None:
+        return devices
+    selected = [device for device in devices
+                if str(wanted) in (device_key(device.config), str(device.config.slave_id))]
+    if not selected:
+        raise ControlError("No such device: %s" % wanted)
+    return selected
+
+
+def _table(args):
+    try:
+        return TABLE_ALIASES[str(args["table"]).strip().lower()]
+    except KeyError:
+        raise ControlError("Unknown table: %s" % args.get("table"))
+
+
+def _check_range(devices, table, start, count):
+    # start/count must lie between the first and last address of the table
+    # on every device (gaps between segments are allowed).
+    for device in devices:
+        segments = device.blocks()[table].segments
+        if count < 1 or not segments or start < segments[0][0] \
+                or start + count > segments[-1][0] + segments[-1][1]:
+            raise ControlError("Addresses %d+%d are outside the %s table" % (start, count, table))
+
+
+def _value(device, table, value):
+    value = int(value)
+    if device.blocks()[table].values.dtype == BIT:
+        return int(value != 0)
+    if not 0 <= value <= 0xFFFF:
+        raise ControlError("Value out of range: %d" % value)
+    return value
+
+
+def _inject(devices, args):
+    # Batch injection: {"table", "values": {address: value, ...}} or
+    # {"table", "start", "values": [value, ...]}.
+    table = _table(args)
+    values = args["values"]
+    if isinstance(values, dict):
+        items = [(int(address), value) for address, value in values.items()]
+    else:
+        start = int(args["start"])
+        items = [(start + i, value) for i, value in enumerate(values)]
+    selected = _devices(devices, args)
+    if not isinstance(values, dict):
+        _check_range(selected, table, start, len(items))
+    for device in selected:
+        device.injections[table].update({address: _value(device, table, value)
+                                         for address, value in items})
+    return {"devices": len(selected), "injected": len(items)}
+
+
+def _fill(devices, args):
+    # Range fill: inject one value into {"table", "start", "count"}.
+    table = _table(args)
+    start, count = int(args["start"]), int(args["count"])
+    selected = _devices(devices, args)
+    _check_range(selected, table, start, count)
+    for device in selected:
+        device.injections[table].set_range(start, count, _value(device, table, args["value"]))
+    return {"devices": len(selected), "injected": count}
+
+
+def _clear(devices, args):
+    # Drop injections: of one table, or of a range of it with start/count.
+    tables = [_table(args)] if "table" in args else TABLES
+    selected = _devices(devices, args)
+    for device in selected:
+        for table in tables:
+            if "start" in args:
+                start, count = int(args["start"]), int(args.get("count", 1))
+                _check_range([device], table, start, count)
+                device.injections[table].clear_range(start, count)
+            else:
+                device.injections[table].clear()
+    return {"devices": len(selected)}
+
+
+def _mode(devices, args):
+    # Word mode switch, optionally with new increment settings.
+    mode = args["mode"]
+    if mode not in WORD_MODES:
+        raise ControlError("Invalid word mode: %s" % mode)
+    changes = {}
+    if args.get("step") is not None:
+        changes["increment_step"] = int(args["step"])
+    if args.get("start") is not None:
+        changes["increment_start"] = int(args["start"])
+    selected = _devices(devices, args)
+    for device in selected:
+        if changes:
+            device.config = dataclasses.replace(device.config, **changes)
+            device.plan = None
+        device.word_mode = mode
+    return {"devices": len(selected), "mode": mode}
+
+
+def _release(devices, args):
+    selected = _devices(devices, args)
+    for device in selected:
+        device.release_writes()
+    return {"devices": len(selected)}
+
+
+def _dump(devices, args):
+    # Published values of a table: the whole table with its segments, or
+    # {"start", "count"} inside one segment. Keyed by device.
+    table = _table(args)
+    dumps = {}
+    for device in _devices(devices, args):
+        block = device.blocks()[table]
+        values = device.store.current.tables[table]
+        dump = {"tick": device.store.current.tick}
+        if "start" in args:
+            start, count = int(args["start"]), int(args.get("count", 1))
+            offset = block._offset(start, count)
+            if offset is None:
+                raise ControlError("Addresses %d-%d are not all in the %s table"
+                                   % (start, start + count - 1, table))
+            dump.update(start=start, values=values[offset:offset + count].astype(int).tolist())
+        else:
+            dump.update(segments=block.segments, values=values.astype(int).tolist())
+        dumps[device_key(device.config)] = dump
+    return dumps
+
+
+def _log(devices, args):
+    # Level of one logger, e.g. {"logger": "pymodbus", "level": "DEBUG"}.
+    name = str(args.get("logger") or "root")
+    return {"logger": name, "level": set_level(name, args["level"])}
+
+
+def _trace(request_trace, devices, args):
+    # Request trace on/off: {"enable": true, "path": "requests.jsonl"} or
+    # {"enable": false}; without "enable" only reports its status.
+    if "enable" in args:
+        if args["enable"]:
+            path = args.get("path") or request_trace.path
+            if not path:
+                raise ControlError("trace: no path given")
+            try:
+                request_trace.enable(str(path))
+            except OSError as e:
+                raise ControlError("trace: %s" % e)
+        else:
+            request_trace.disable()
+    return request_trace.status()
+
+
+COMMANDS = {
+    "inject": _inject,
+    "fill": _fill,
+    "clear": _clear,
+    "mode": _mode,
+    "release": _release,
+    "dump": _dump,
+    "log": _log,
+}
@@ -0,0 +1,479 @@
+import bisect
+import threading
+import time
+import numpy as np
+from pymodbus.datastore.store import BaseModbusDataBlock
+
+# Table dtypes: bit tables (coils, discrete inputs) hold bools,
+# word tables (holding, input registers) hold unsigned 16 bit words in
+# Modbus (big-endian) byte order, so a slice of a table is already the
+# payload of a read response.
+BIT = np.bool_
+WORD = np.dtype(">u2")
+
+# Upper bound (exclusive) of the random word values, as before.
+RANDOM_WORD_LIMIT = 32768
+
+
+def random_bits(rng, size):
+    # size random bits from one draw of (size + 7) // 8 random bytes.
+    data = np.frombuffer(rng.bytes((size + 7) // 8), dtype=np.uint8)
+    return np.unpackbits(data, count=size).view(BIT)
+
+
+def merge_segments(segments):
+    # Sort (start, count) segments and merge the adjacent ones.
+    # Raises ValueError on overlapping or negative segments.
+    merged = []
+    for start, count in sorted((int(s), int(c)) for s, c in segments):
+        if start < 0 or count < 0:
+            raise ValueError("Invalid segment (%d, %d)" % (start, count))
+        if count == 0:
+            continue
+        if merged and start < merged[-1][0] + merged[-1][1]:
+            raise ValueError("Segment at %d overlaps the previous one" % start)
+        if merged and start == merged[-1][0] + merged[-1][1]:
+            merged[-1] = (merged[-1][0], merged[-1][1] + count)
+        else:
+            merged.append((start, count))
+    return merged
+
+
+class NumpyDataBlock(BaseModbusDataBlock):
+    # A datablock backed by one preallocated NumPy array. The update loop
+    # rewrites the array in place with the bulk helpers below; the server
+    # reads slices of it through getValues().
+    #
+    # The array may hold several address segments back to back (see
+    # SegmentedDataBlock); a plain NumpyDataBlock has exactly one.
+
+    def __init__(self, address, count, dtype=WORD):
+        self._allocate([(address, count)], dtype)
+
+    def _allocate(self, segments, dtype):
+        # Set by SnapshotStore.attach(): reads then go through the store's
+        # published image and self.values is the writer's back buffer.
+        self.store = None
+        self.name = None
+        segments = merge_segments(segments)
+        self.segments = segments
+        self.address = segments[0][0] if segments else 0
+        self.values = np.zeros(sum(count for _, count in segments), dtype=dtype)
+        self.default_value = self.values.dtype.type(0)
+        # Segment starts/ends and the position of each segment in self.values.
+        self._starts = [start for start, _ in segments]
+        self._ends = [start + count for start, count in segments]
+        self._bases = np.cumsum([0] + [count for _, count in segments])[:-1].tolist()
+        self._starts_array = np.array(self._starts, dtype=np.int64)
+        self._ends_array = np.array(self._ends, dtype=np.int64)
+        self._bases_array = np.array(self._bases, dtype=np.int64)
+        # Compiled injections: (source map, version, positions, values).
+        self._overlay = None
+        # Client write tracking, off until track_writes() is called.
+        self.held = None
+        # (start, stop) positions written by clients since take_written().
+        self._written = []
+        # Guards _written and the held-write arrays against the request
+        # handler threads.
+        self._write_lock = threading.Lock()
+
+    def _offset(self, address, count):
+        # Position of [address, address + count) in self.values, or None if
+        # the range is not entirely inside one segment. O(log segments).
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0 or count <= 0 or address + count > self._ends[index]:
+            return None
+        return self._bases[index] + address - self._starts[index]
+
+    def address_at(self, position):
+        # Inverse of _offset(): the address stored at self.values[position].
+        index = bisect.bisect_right(self._bases, position) - 1
+        return self._starts[index] + position - self._bases[index]
+
+    def addresses_at(self, positions):
+        # address_at() for an array of positions.
+        index = np.searchsorted(self._bases_array, positions, side="right") - 1
+        return self._starts_array[index] + positions - self._bases_array[index]
+
+    def validate(self, address, count=1):
+        return self._offset(address, count) is not None
+
+    def getValues(self, address, count=1):
+        offset = self._offset(address, count)
+        if self.store is not None:
+            return self.store.read(self.name, offset, offset + count)
+        return self.values[offset:offset + count].tolist()
+
+    def read_bytes(self, address, count):
+        # Response payload for a read of count values: the big-endian words,
+        # or the bits packed LSB first. None when the range is invalid.
+        offset = self._offset(address, count)
+        if offset is None:
+            return None
+        if self.store is not None:
+            return self.store.read_bytes(self.name, offset, offset + count)
+        return table_bytes(self.values[offset:offset + count])
+
+    def setValues(self, address, values):
+        if not isinstance(values, (list, tuple, np.ndarray)):
+            values = [values]
+        offset = self._offset(address, len(values))
+        if self.store is not None:
+            written = self.store.write(self.name, offset, values)
+        else:
+            self.values[offset:offset + len(values)] = values
+            written = self.values[offset:offset + len(values)]
+        with self._write_lock:
+            self._written.append((offset, offset + len(values)))
+        if self.held is not None:
+            self._hold(offset, written)
+
+    def reset(self):
+        self.values.fill(0)
+
+    # ----------------- Client writes -----------------
+
+    def track_writes(self, hold=None):
+        # Make client-written addresses sticky: apply_writes() puts them back
+        # over the generated values for hold seconds after the last write, or
+        # until release_writes() when hold is None. held is the dirty bitmap;
+        # the positions it marks are kept as an index array that is rebuilt
+        # only after writes or expiries, so a tick without held addresses
+        # costs one attribute check.
+        size = len(self.values)
+        self.write_hold = hold
+        self.held = np.zeros(size, dtype=bool)
+        self.held_values = np.zeros(size, dtype=self.values.dtype)
+        self.held_since = np.zeros(size, dtype=np.float64)
+        self._held_positions = np.zeros(0, dtype=np.int64)
+        self._held_stale = False
+
+    def _hold(self, offset, values):
+        stop = offset + len(values)
+        with self._write_lock:
+            self.held[offset:stop] = True
+            self.held_values[offset:stop] = values
+            self.held_since[offset:stop] = time.monotonic()
+            self._held_stale = True
+
+    def apply_writes(self, now=None):
+        # Overwrite the held addresses of self.values with the client values.
+        if self.held is None or not (self._held_stale or len(self._held_positions)):
+            return
+        with self._write_lock:
+            if self._held_stale:
+                self._held_positions = np.flatnonzero(self.held)
+                self._held_stale = False
+            positions = self._held_positions
+            if self.write_hold is not None and len(positions):
+                now = time.monotonic() if now is None else now
+                expired = now - self.held_since[positions] >= self.write_hold
+                if expired.any():
+                    self.held[positions[expired]] = False
+                    positions = self._held_positions = positions[~expired]
+            self.values[positions] = self.held_values[positions]
+
+    def release_writes(self):
+        # Drop every held client write; the generator owns the table again.
+        if self.held is None:
+            return
+        with self._write_lock:
+            self.held.fill(False)
+            self._held_positions = np.zeros(0, dtype=np.int64)
+            self._held_stale = False
+
+    def take_written(self):
+        # Sorted positions written by clients since the last call.
+        with self._write_lock:
+            written, self._written = self._written, []
+        if not written:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([np.arange(start, stop) for start, stop in written]))
+
+    def held_count(self):
+        if self.held is None:
+            return 0
+        return int(np.count_nonzero(self.held))
+
+    # ----------------- Bulk updates -----------------
+
+    def fill(self, value):
+        if self.values.dtype == WORD:
+            value = int(value) & 0xFFFF
+        self.values.fill(value)
+
+    def fill_random(self, rng):
+        if self.values.dtype == BIT:
+            self.values[:] = random_bits(rng, len(self.values))
+        else:
+            self.values[:] = rng.integers(0, RANDOM_WORD_LIMIT, size=len(self.values), dtype=np.uint16)
+
+    def offsets(self, addresses):
+        # Vectorized address -> position lookup. Returns (positions, mask)
+        # where mask marks the addresses that fall inside a segment.
+        addresses = np.asarray(addresses, dtype=np.int64)
+        if not self.segments:
+            return np.zeros(len(addresses), dtype=np.int64), np.zeros(len(addresses), dtype=bool)
+        index = np.searchsorted(self._starts_array, addresses, side="right") - 1
+        safe = np.maximum(index, 0)
+        mask = (index >= 0) & (addresses < self._ends_array[safe])
+        positions = self._bases_array[safe] + addresses - self._starts_array[safe]
+        return positions, mask
+
+    def compile_injections(self, injections):
+        # (positions, values) arrays for the addresses in {address: value}
+        # that fall inside the block, values already in the block dtype.
+        if hasattr(injections, "copy_items"):
+            version, items = injections.copy_items()
+        else:
+            version, items = None, list(injections.items())
+        addresses = np.fromiter((address for address, _ in items), dtype=np.int64, count=len(items))
+        values = np.fromiter((value for _, value in items), dtype=np.int64, count=len(items))
+        positions, in_range = self.offsets(addresses)
+        if self.values.dtype == BIT:
+            values = values[in_range] != 0
+        else:
+            values = (values[in_range] & 0xFFFF).astype(WORD)
+        return version, positions[in_range], values
+
+    def inject(self, injections):
+        # Overwrite the injected addresses with one vectorized scatter. The
+        # overlay is recompiled only when the map's version changes; plain
+        # dicts have no version and are compiled on every call. Returns the
+        # injected positions after a recompile (their values may have
+        # changed), else None.
+        if not injections:
+            return None
+        overlay = self._overlay
+        version = getattr(injections, "version", None)
+        compiled = None
+        if overlay is None or overlay[0] is not injections or version is None or overlay[1] != version:
+            version, positions, values = self.compile_injections(injections)
+            overlay = self._overlay = (injections, version, positions, values)
+            compiled = positions
+        self.values[overlay[2]] = overlay[3]
+        return compiled
+
+
+class SegmentedDataBlock(NumpyDataBlock):
+    # A sparse datablock that only stores the configured address segments,
+    # e.g. [(0, 100), (10000, 100), (40000, 1000)] allocates 1200 values.
+    # Requests that touch a gap fail validation, which the server answers
+    # with an IllegalAddress exception.
+
+    def __init__(self, segments, dtype=WORD):
+        self._allocate(segments, dtype)
+
+
+class RegisterImage(object):
+    # One consistent set of tables for one tick. generation is odd while
+    # the writer is filling the image and even once it is stable. packed
+    # holds the bit tables again one bit per address (LSB first, as FC1/2
+    # send them), refreshed on publish. versions identifies the content of
+    # each table: images with equal versions of a table hold equal values.
+    __slots__ = ("tables", "packed", "versions", "tick", "generation")
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.packed = {name: np.zeros((len(table) + 7) // 8, dtype=np.uint8)
+                       for name, table in tables.items() if table.dtype == BIT}
+        self.versions = {name: 0 for name in tables}
+        self.tick = 0
+        self.generation = 0
+
+
+class SnapshotStore(object):
+    # Lock-free publication of register images between the update loop and
+    # the request handlers. The writer fills the next image of a small ring
+    # (begin), then publishes it with a single reference swap (publish).
+    # Readers never block: they copy out of the current image and retry in
+    # the rare case the writer recycled that image meanwhile (seqlock).
+    # Client writes (write) go into the published image under its seqlock
+    # and, during a tick, into the image being built, so the next publish
+    # keeps them; a lock orders them with begin and publish. A tick that
+    # updates some tables only copies those, and the others whose content
+    # changed since the image last held them (see RegisterImage.versions).
+
+    def __init__(self, blocks, depth=3):
+        # blocks: {name: NumpyDataBlock}; their current values seed the
+        # first image.
+        self.blocks = blocks
+        self._ring = []
+        for index in range(depth):
+            self._ring.append(RegisterImage({
+                name: self._new_table(index, name, block) for name, block in blocks.items()
+            }))
+        self._index = 0
+        self._lock = threading.Lock()
+        # The image between begin() and publish(), else None.
+        self._building = None
+        self._updating = None
+        # Table content versions handed out so far; the other images start
+        # at 0, i.e. older than the seeded one.
+        self._version = 1
+        # Bit tables written into the image being built.
+        self._repack_names = set()
+        self._current_index = 0
+        self.current = self._ring[0]
+        for name, block in blocks.items():
+            np.copyto(self.current.tables[name], block.values)
+            block.store = self
+            block.name = name
+            block.values = self.current.tables[name]
+            self.current.versions[name] = self._version
+        self.repack()
+
+    def _new_table(self, index, name, block):
+        # Storage for one table of ring image index; subclasses may place
+        # it elsewhere, e.g. in shared memory.
+        return np.empty_like(block.values)
+
+    def begin(self, tables=None):
+        # Start the next image from the published one and point every
+        # block's values at it for the bulk updates. tables: the names this
+        # tick updates (None for all); the others are only copied if the
+        # image holds an older version of them.
+        with self._lock:
+            self._index = (self._index + 1) % len(self._ring)
+            image = self._ring[self._index]
+            current = self.current
+            self._set_generation(self._index, image.generation + 1)
+            for name, block in self.blocks.items():
+                if tables is None or name in tables:
+                    np.copyto(image.tables[name], current.tables[name])
+                elif image.versions[name] != current.versions[name]:
+                    np.copyto(image.tables[name], current.tables[name])
+                    if name in image.packed:
+                        np.copyto(image.packed[name], current.packed[name])
+                image.versions[name] = current.versions[name]
+                block.values = image.tables[name]
+            self._building = image
+            self._updating = tables
+        return image
+
+    def publish(self):
+        with self._lock:
+            image = self._ring[self._index]
+            updating = self._updating
+            for name, packed in image.packed.items():
+                if updating is None or name in updating or name in self._repack_names:
+                    packed[:] = np.packbits(image.tables[name], bitorder="little")
+            self._version += 1
+            for name in image.tables if updating is None else updating:
+                image.versions[name] = self._version
+            image.tick = self.current.tick + 1
+            self._set_generation(self._index, image.generation + 1)
+            self.current = image
+            self._current_index = self._index
+            self._building = None
+            self._repack_names.clear()
+
+    def _set_generation(self, index, generation):
+        # Every generation change of ring image index goes through here.
+        self._ring[index].generation = generation
+
+    def write(self, name, offset, values):
+        # Client write of values at offset of one table; returns them as
+        # stored. Readers of the published image retry while it is written.
+        with self._lock:
+            image = self.current
+            index = self._current_index
+            table = image.tables[name]
+            values = np.asarray(values, dtype=table.dtype)
+            stop = offset + len(values)
+            self._set_generation(index, image.generation + 1)
+            table[offset:stop] = values
+            if name in image.packed:
+                self._repack(image, name, offset, stop)
+            self._set_generation(index, image.generation + 1)
+            self._version += 1
+            image.versions[name] = self._version
+            if self._building is not None:
+                self._building.tables[name][offset:stop] = values
+                self._building.versions[name] = self._version
+                if name in image.packed:
+                    self._repack_names.add(name)
+        return values
+
+    def touch(self, name=None):
+        # After writing tables of the published image in place (e.g. a
+        # state restore): repack them and have the other images copy them.
+        with self._lock:
+            for table in [name] if name is not None else list(self.current.tables):
+                self._version += 1
+                self.current.versions[table] = self._version
+            self.repack(name)
+
+    def read(self, name, start, stop):
+        # Copy [start:stop) of one table from a stable image as a list.
+        while True:
+            image = self.current
+            generation = image.generation
+            values = image.tables[name][start:stop].tolist()
+            if not generation & 1 and image.generation == generation:
+                return values
+
+    def repack(self, name=None, start=0, stop=None):
+        # Refresh the packed copy of the published bits [start, stop) of one
+        # bit table (all of them by default) after writing to it directly.
+        image = self.current
+        for table in [name] if name is not None else list(image.packed):
+            self._repack(image, table, start, stop)
+
+    def _repack(self, image, name, start=0, stop=None):
+        values = image.tables[name]
+        first = start >> 3
+        last = len(values) if stop is None else min(((stop + 7) >> 3) << 3, len(values))
+        image.packed[name][first:(last + 7) >> 3] = np.packbits(values[first << 3:last],
+                                                                bitorder="little")
+
+    def read_bytes(self, name, start, stop):
+        # Like read(), as response payload bytes (see table_bytes). The
+        # slice is copied once under the seqlock: sending a view of the
+        # ring directly could transmit an image the writer is recycling.
+        # Bits come from the packed copy: the bytes covering the range are
+        # shifted down to bit 0 with one integer shift.
+        if name in self.current.packed:
+            return self._read_bits(name, start, stop)
+        while True:
+            image = self.current
+            generation = image.generation
+            data = table_bytes(image.tables[name][start:stop])
+            if not generation & 1 and image.generation == generation:
+                return data
+
+    def _read_bits(self, name, start, stop):
+        while True:
+            image = self.current
+            generation = image.generation
+            data = image.packed[name][start >> 3:(stop + 7) >> 3].tobytes()
+            if not generation & 1 and image.generation == generation:
+                break
+        count = stop - start
+        bits = (int.from_bytes(data, "little") >> (start & 7)) & ((1 << count) - 1)
+        return bits.to_bytes((count + 7) // 8, "little")
+
+    def snapshot(self):
+        # (tick, {name: array copy}) of all tables from the same tick.
+        while True:
+            image = self.current
+            generation = image.generation
+            tables = {name: table.copy() for name, table in image.tables.items()}
+            if not generation & 1 and image.generation == generation:
+                return image.tick, tables
+
+
+def table_bytes(values):
+    # Wire encoding of a table slice: words are stored big-endian already;
+    # bits are packed eight per byte, LSB first, as Modbus sends coils.
+    if values.dtype == BIT:
+        return np.packbits(values, bitorder="little").tobytes()
+    return values.tobytes()
+
+
+def create_block(segments, dtype=WORD):
+    # NumpyDataBlock for a contiguous table, SegmentedDataBlock otherwise.
+    segments = merge_segments(segments)
+    if len(segments) == 1:
+        return NumpyDataBlock(segments[0][0], segments[0][1], dtype)
+    return SegmentedDataBlock(segments, dtype)
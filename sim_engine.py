@@ -0,0 +1,276 @@
+import logging
+import os
+import socket
+import struct
+import time
+import traceback
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.pdu import ModbusExceptions as merror
+from pymodbus.server.sync import ModbusConnectedRequestHandler, ModbusTcpServer
+# Engine names and defaults live with the config; ENGINES and
+# DEFAULT_ENGINE are re-exported for existing imports.
+from sim_config import DEFAULT_ENGINE, DEFAULT_MAX_INFLIGHT, ENGINES
+from sim_datastore import NumpyDataBlock
+
+log = logging.getLogger(__name__)
+
+# Bytes read from a client socket at once (threaded engine).
+RECV_SIZE = 65536
+
+# Largest MBAP length field (unit ID and PDU) of a valid frame.
+MAX_MBAP_LENGTH = 254
+
+# Buffers one sendmsg() accepts.
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+
+# Read function codes answered straight from the register store:
+# {function code: (ModbusSlaveContext store key, largest count)}.
+FAST_READS = {1: ("c", 2000), 2: ("d", 2000), 3: ("h", 125), 4: ("i", 125)}
+
+
+class RawResponse(object):
+    # A read response encoded by fast_read(): the MBAP header and PDU head,
+    # then the payload bytes taken from the store, written as separate
+    # buffers. Carries what the engines and Metrics need of a response.
+    __slots__ = ("function_code", "transaction_id", "unit_id", "buffers")
+    should_respond = True
+
+    def __init__(self, function_code, transaction_id, unit_id, buffers):
+        self.function_code = function_code
+        self.transaction_id = transaction_id
+        self.unit_id = unit_id
+        self.buffers = buffers
+
+
+def fast_read(context, request):
+    # FC1-4 against NumpyDataBlocks without building per-register Python
+    # lists. Returns None whenever the regular path should answer, which
+    # includes every error, so exceptions are reported exactly as before.
+    spec = FAST_READS.get(request.function_code)
+    if spec is None:
+        return None
+    try:
+        slave = context[request.unit_id]
+    except NoSuchSlaveException:
+        return None
+    block = getattr(slave, "store", {}).get(spec[0])
+    count = request.count
+    if not isinstance(block, NumpyDataBlock) or not 1 <= count <= spec[1]:
+        return None
+    address = request.address if slave.zero_mode else request.address + 1
+    payload = block.read_bytes(address, count)
+    if payload is None:
+        return None
+    header = struct.pack(">HHHBBB", request.transaction_id, 0, len(payload) + 3,
+                         request.unit_id, request.function_code, len(payload))
+    return RawResponse(request.function_code, request.transaction_id, request.unit_id,
+                       [header, payload])
+
+
+def frame_prefix(data, limit, start=0):
+    # Length of the part of data from start that holds its first `limit`
+    # complete MBAP frames, or fewer if fewer are complete (0 for none). A
+    # header with an impossible length ends the count with all of data,
+    # which is then left to the framer to discard as before.
+    end = start
+    frames = 0
+    while frames < limit and end + 6 <= len(data):
+        length = (data[end + 4] << 8) | data[end + 5]
+        if not 2 <= length <= MAX_MBAP_LENGTH:
+            return len(data) - start
+        if end + 6 + length > len(data):
+            break
+        end += 6 + length
+        frames += 1
+    return end - start
+
+
+def encode_response(framer, response):
+    # Buffers to write for one response.
+    if isinstance(response, RawResponse):
+        return response.buffers
+    return [framer.buildPacket(response)]
+
+
+def execute_request(context, request):
+    # Run one decoded request against the server context; errors become
+    # Modbus exception responses, as in pymodbus' own handlers.
+    response = fast_read(context, request)
+    if response is not None:
+        return response
+    try:
+        response = request.execute(context[request.unit_id])
+    except NoSuchSlaveException:
+        log.debug("requested slave does not exist: %s", request.unit_id)
+        response = request.doException(merror.GatewayNoResponse)
+    except Exception as e:
+        log.debug("Datastore unable to fulfill request: %s", e)
+        response = request.doException(merror.SlaveFailure)
+    response.transaction_id = request.transaction_id
+    response.unit_id = request.unit_id
+    return response
+
+
+# Subclass the ModbusTcpServer to allow address reuse.
+class ReusableModbusTcpServer(ModbusTcpServer):
+    allow_reuse_address = True
+
+    def __init__(self, context, address, metrics=None, max_inflight=DEFAULT_MAX_INFLIGHT,
+                 trace=None):
+        self.metrics = metrics
+        self.trace = trace
+        self.max_inflight = max(1, max_inflight)
+        ModbusTcpServer.__init__(self, context=context, address=address,
+                                 handler=PipelinedRequestHandler,
+                                 allow_reuse_address=self.allow_reuse_address)
+
+
+class PipelinedRequestHandler(ModbusConnectedRequestHandler):
+    # Threaded-engine handler. Requests are taken off the socket at most
+    # max_inflight complete frames at a time (the rest stays in the kernel
+    # buffer, so TCP flow control holds the client back), executed back to
+    # back and answered with one sendmsg(), instead of one send() per
+    # request. Reports to the server's Metrics and RequestTrace when it has
+    # them.
+
+    def setup(self):
+        ModbusConnectedRequestHandler.setup(self)
+        self.batch = []
+        # Received bytes of an incomplete frame.
+        self.partial = b""
+        self.peer = "%s:%s" % self.client_address[:2]
+        if self.server.metrics is not None:
+            self.server.metrics.connection_opened()
+
+    def finish(self):
+        if self.server.metrics is not None:
+            self.server.metrics.connection_closed()
+        ModbusConnectedRequestHandler.finish(self)
+
+    def handle(self):
+        context = self.server.context
+        while self.running:
+            try:
+                frames = self.receive()
+                if frames is None:
+                    self.running = False
+                    break
+                if not frames:
+                    continue
+                units = context.slaves()
+                if not isinstance(units, (list, tuple)):
+                    units = [units]
+                self.framer.processIncomingPacket(frames, self.batch.append, units,
+                                                  single=context.single)
+                self.flush()
+            except socket.error as e:
+                log.error("Socket error occurred %s", e)
+                self.running = False
+            except Exception:
+                log.error("Socket exception occurred %s", traceback.format_exc())
+                self.framer.resetFrame()
+                self.running = False
+            finally:
+                self.batch = []
+
+    def receive(self):
+        # The bytes of the next (up to) max_inflight complete frames, b""
+        # after taking the start of an incomplete one, None once the client
+        # closed. Peeks first so that no more frames leave the socket.
+        limit = self.server.max_inflight
+        data = self.request.recv(min(RECV_SIZE, limit * (6 + MAX_MBAP_LENGTH)), socket.MSG_PEEK)
+        if not data:
+            return None
+        buffered = self.partial + data
+        size = frame_prefix(buffered, limit)
+        if size == 0:
+            self._consume(len(data))
+            self.partial = buffered
+            return b""
+        self._consume(size - len(self.partial))
+        self.partial = b""
+        return buffered[:size]
+
+    def _consume(self, size):
+        # Drop size peeked bytes from the socket.
+        while size > 0:
+            data = self.request.recv(size)
+            if not data:
+                raise socket.error("connection closed")
+            size -= len(data)
+
+    def flush(self):
+        context = self.server.context
+        metrics = self.server.metrics
+        trace = self.server.trace
+        batch = self.batch
+        for first in range(0, len(batch), self.server.max_inflight):
+            started = time.perf_counter()
+            requests = batch[first:first + self.server.max_inflight]
+            responses, packets, latencies = execute_batch(context, self.framer, requests)
+            if packets:
+                send_vectored(self.request, packets)
+            elapsed = time.perf_counter() - started
+            if metrics is not None:
+                for response, latency in zip(responses, latencies):
+                    metrics.observe_request(response, latency)
+            if trace is not None and trace.enabled:
+                trace.record(self.peer, requests, responses, elapsed)
+
+
+def execute_batch(context, framer, requests):
+    # Execute and encode requests in order: (responses, buffers to write,
+    # seconds each request took). Latencies are per request, so a batch
+    # does not charge its total to every request in it.
+    responses = []
+    packets = []
+    latencies = []
+    clock = time.perf_counter
+    for request in requests:
+        started = clock()
+        response = execute_request(context, request)
+        if response.should_respond:
+            packets.extend(encode_response(framer, response))
+        responses.append(response)
+        latencies.append(clock() - started)
+    return responses, packets, latencies
+
+
+def send_vectored(sock, packets):
+    # Write all packets with as few system calls as possible, at most
+    # IOV_MAX buffers per call.
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(packets))
+        return
+    packets = list(packets)
+    index = 0
+    while index < len(packets):
+        sent = sock.sendmsg(packets[index:index + IOV_MAX])
+        while index < len(packets) and sent >= len(packets[index]):
+            sent -= len(packets[index])
+            index += 1
+        if sent:
+            packets[index] = memoryview(packets[index])[sent:]
+
+
+def create_server(engine, context, address, metrics=None, max_inflight=DEFAULT_MAX_INFLIGHT,
+                  trace=None):
+    # metrics: optional sim_metrics.Metrics fed by the request handlers.
+    # max_inflight: per-connection cap on requests taken in and not yet
+    # answered.
+    # trace: optional sim_logging.RequestTrace, fed while it is enabled.
+    if engine == "threaded":
+        return ReusableModbusTcpServer(context=context, address=address, metrics=metrics,
+                                       max_inflight=max_inflight, trace=trace)
+    if engine == "asyncio":
+        # Imported on first use: asyncio is only loaded for this engine.
+        from sim_engine_asyncio import AsyncModbusTcpServer
+        return AsyncModbusTcpServer(context=context, address=address, metrics=metrics,
+                                    max_inflight=max_inflight, trace=trace)
+    raise ValueError("Unknown server engine: %s" % engine)
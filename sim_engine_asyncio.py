@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import threading
+import time
+import traceback
+from pymodbus.factory import ServerDecoder
+from pymodbus.transaction import ModbusSocketFramer
+from sim_config import DEFAULT_MAX_INFLIGHT
+from sim_engine import execute_batch, frame_prefix
+
+# The asyncio engine (see sim_engine.create_server), kept apart so the
+# threaded engine never loads asyncio.
+
+log = logging.getLogger("sim_engine")
+
+
+class ModbusAsyncProtocol(asyncio.Protocol):
+    # One instance per client connection. Frames are decoded with the same
+    # framer/decoder as the threaded server and executed against the same
+    # server context, so both engines answer identically. At most
+    # max_inflight received requests are executed per loop iteration; the
+    # client is not read from while more are waiting.
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.framer = None
+        self.peer = None
+        self.batch = []
+        # Received bytes from `offset` on are not executed yet.
+        self.buffer = bytearray()
+        self.offset = 0
+        self.scheduled = False
+        self.writing_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = "%s:%s" % tuple(transport.get_extra_info("peername") or ("?", "?"))[:2]
+        self.framer = ModbusSocketFramer(self.server.decoder, client=None)
+        self.server.transports.add(transport)
+        if self.server.metrics is not None:
+            self.server.metrics.connection_opened()
+        log.debug("Client Connected [%s]", transport.get_extra_info("peername"))
+
+    def connection_lost(self, exc):
+        self.server.transports.discard(self.transport)
+        if self.server.metrics is not None:
+            self.server.metrics.connection_closed()
+        log.debug("Client Disconnected [%s]", self.transport.get_extra_info("peername"))
+
+    def data_received(self, data):
+        if not self.buffer and not self.scheduled and not self.writing_paused \
+                and frame_prefix(data, self.server.max_inflight) == len(data):
+            # The usual case: whole frames, no more than the cap.
+            self.execute(data)
+            return
+        self.buffer += data
+        if not self.scheduled:
+            self.process()
+
+    def process(self):
+        # Execute the next (up to) max_inflight complete frames. While more
+        # are waiting, stop reading from the client and go on in the next
+        # loop iteration, so other connections are served in between.
+        self.scheduled = False
+        if self.transport.is_closing() or self.writing_paused:
+            return
+        size = frame_prefix(self.buffer, self.server.max_inflight, self.offset)
+        if size:
+            frames = bytes(self.buffer[self.offset:self.offset + size])
+            self.offset += size
+            if self.offset == len(self.buffer) or self.offset > 65536:
+                del self.buffer[:self.offset]
+                self.offset = 0
+            if not self.execute(frames):
+                return
+        if frame_prefix(self.buffer, 1, self.offset):
+            self.scheduled = True
+            self.server.loop.call_soon(self.process)
+        self._update_reading()
+
+    def execute(self, frames):
+        # Decode, execute and answer the requests in frames; False if the
+        # connection was closed over an error.
+        context = self.server.context
+        units = context.slaves()
+        if not isinstance(units, (list, tuple)):
+            units = [units]
+        try:
+            self.framer.processIncomingPacket(frames, self.batch.append, units,
+                                              single=context.single)
+            self.flush()
+        except Exception:
+            log.error("Socket exception occurred %s", traceback.format_exc())
+            self.framer.resetFrame()
+            self.transport.close()
+            return False
+        finally:
+            self.batch = []
+        return True
+
+    def flush(self):
+        # Execute the decoded requests and write their responses with one
+        # writelines() per max_inflight requests.
+        context = self.server.context
+        metrics = self.server.metrics
+        trace = self.server.trace
+        batch = self.batch
+        for first in range(0, len(batch), self.server.max_inflight):
+            started = time.perf_counter()
+            requests = batch[first:first + self.server.max_inflight]
+            responses, packets, latencies = execute_batch(context, self.framer, requests)
+            if packets and not self.transport.is_closing():
+                self.transport.writelines(packets)
+            elapsed = time.perf_counter() - started
+            if metrics is not None:
+                for response, latency in zip(responses, latencies):
+                    metrics.observe_request(response, latency)
+            if trace is not None and trace.enabled:
+                trace.record(self.peer, requests, responses, elapsed)
+
+    def pause_writing(self):
+        # The client is not reading its responses: stop reading its requests
+        # until the transport's buffer drains.
+        self.writing_paused = True
+        self._update_reading()
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if not self.scheduled:
+            self.process()
+
+    def _update_reading(self):
+        if self.transport.is_closing():
+            return
+        if self.writing_paused or self.scheduled:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+
+class AsyncModbusTcpServer(object):
+    # Asyncio counterpart of ReusableModbusTcpServer. It exposes the same
+    # serve_forever()/shutdown()/server_close() trio so callers can stop
+    # either engine the same way from another thread.
+
+    def __init__(self, context, address, backlog=1024, metrics=None,
+                 max_inflight=DEFAULT_MAX_INFLIGHT, trace=None):
+        self.context = context
+        self.metrics = metrics
+        self.trace = trace
+        self.max_inflight = max(1, max_inflight)
+        self.address = address
+        self.backlog = backlog
+        self.decoder = ServerDecoder()
+        self.transports = set()
+        self.loop = None
+        self._server = None
+        self._stop = None
+        self._stopping = False
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def serve_forever(self):
+        self._is_shut_down.clear()
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+            self._is_shut_down.set()
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        if self._stopping:
+            return
+        host, port = self.address
+        self._server = await self.loop.create_server(
+            lambda: ModbusAsyncProtocol(self), host or None, port,
+            reuse_address=True, backlog=self.backlog)
+        try:
+            if not self._stopping:
+                await self._stop.wait()
+        finally:
+            self._server.close()
+            for transport in list(self.transports):
+                transport.close()
+            await self._server.wait_closed()
+
+    @property
+    def connections(self):
+        return len(self.transports)
+
+    def shutdown(self):
+        self._stopping = True
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._request_stop)
+            except RuntimeError:
+                # The loop closed between the check and the call.
+                pass
+        self._is_shut_down.wait()
+
+    def _request_stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    def server_close(self):
+        # Sockets are released when serve_forever() returns.
+        pass
@@ -0,0 +1,268 @@
+import numpy as np
+from sim_datastore import random_bits
+
+# Registered generator classes by name, see register_generator().
+GENERATORS = {}
+
+WORD_MAX = 0xFFFF
+
+
+def register_generator(name):
+    # Class decorator that makes a Generator available to configs as
+    # {"type": name, ...}.
+    def decorator(cls):
+        cls.name = name
+        GENERATORS[name] = cls
+        return cls
+    return decorator
+
+
+def create_generator(spec, size, dtype, rng):
+    # Instantiate a generator from a config spec such as
+    # {"type": "sine", "period": 10, "amplitude": 1000, "offset": 2000}.
+    # Raises ValueError for unknown types or parameters.
+    params = {key: value for key, value in spec.items()
+              if key not in ("type", "start", "count")}
+    try:
+        cls = GENERATORS[spec["type"]]
+    except KeyError:
+        raise ValueError("Unknown generator type: %s" % spec.get("type"))
+    try:
+        return cls(size, dtype, rng, **params)
+    except TypeError as e:
+        raise ValueError("Invalid %s generator parameters: %s" % (spec["type"], e))
+
+
+class Generator(object):
+    # Base class for value generators. One instance owns a fixed set of
+    # addresses of one table; generate() is called once per tick and must
+    # fill `out` (a NumPy array of the table dtype, one slot per owned
+    # address) in a few vectorized operations.
+    #
+    # tick is the device's tick counter and t the simulated time in seconds
+    # (tick * update interval), so output only depends on the tick and the
+    # rng, which makes seeded runs replayable.
+
+    def __init__(self, size, dtype, rng):
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.rng = rng
+        self._scratch = np.empty(size, dtype=np.float64)
+        self._full = None
+
+    def generate(self, tick, t, out):
+        raise NotImplementedError
+
+    def generate_at(self, tick, t, positions, out):
+        # Like generate(), for the owned addresses at positions (sorted
+        # indices into the range) only; used by sparse updates. This
+        # fallback generates the whole range, generators override it with
+        # work proportional to len(positions).
+        if self._full is None:
+            self._full = np.empty(self.size, dtype=self.dtype)
+        self.generate(tick, t, self._full)
+        out[:] = self._full[positions]
+
+    def get_state(self):
+        # Everything generate() depends on besides (tick, t), for snapshots.
+        # Values may be NumPy arrays; subclasses with state extend the dict.
+        return {"rng": self.rng.bit_generator.state}
+
+    def set_state(self, state):
+        self.rng.bit_generator.state = state["rng"]
+
+    def store(self, signal, out):
+        # Write a float signal into out: words are rounded and clipped to
+        # 16 bits, bits are set where the signal is >= 0.5.
+        if self.dtype == np.bool_:
+            np.greater_equal(signal, 0.5, out=out)
+        else:
+            np.rint(signal, out=signal)
+            np.clip(signal, 0, WORD_MAX, out=signal)
+            out[:] = signal
+
+
+@register_generator("random")
+class RandomGenerator(Generator):
+    # Uniform random words in [low, high] or random bits.
+
+    def __init__(self, size, dtype, rng, low=0, high=32767):
+        Generator.__init__(self, size, dtype, rng)
+        self.low = int(low)
+        self.high = int(high)
+
+    def generate(self, tick, t, out):
+        if self.dtype == np.bool_:
+            out[:] = random_bits(self.rng, self.size)
+        else:
+            out[:] = self.rng.integers(self.low, self.high + 1, size=self.size, dtype=np.uint16)
+
+    def generate_at(self, tick, t, positions, out):
+        if self.dtype == np.bool_:
+            out[:] = random_bits(self.rng, len(positions))
+        else:
+            out[:] = self.rng.integers(self.low, self.high + 1, size=len(positions), dtype=np.uint16)
+
+
+@register_generator("constant")
+class ConstantGenerator(Generator):
+
+    def __init__(self, size, dtype, rng, value=0):
+        Generator.__init__(self, size, dtype, rng)
+        self.value = bool(value) if self.dtype == np.bool_ else int(value) & WORD_MAX
+
+    def generate(self, tick, t, out):
+        out.fill(self.value)
+
+    def generate_at(self, tick, t, positions, out):
+        out.fill(self.value)
+
+
+@register_generator("incremental")
+class IncrementalGenerator(Generator):
+    # Every address holds base + tick * step, wrapping at 16 bits.
+
+    def __init__(self, size, dtype, rng, base=0, step=1):
+        Generator.__init__(self, size, dtype, rng)
+        self.base = int(base)
+        self.step = int(step)
+
+    def generate(self, tick, t, out):
+        out.fill((self.base + tick * self.step) & WORD_MAX)
+
+    def generate_at(self, tick, t, positions, out):
+        self.generate(tick, t, out)
+
+
+class WaveformGenerator(Generator):
+    # offset + amplitude * wave(t / period + phase), where wave maps one
+    # cycle to [-1, 1]. "spread" shifts each address's phase by spread/size
+    # of a cycle so a range shows a travelling wave instead of one value.
+
+    def __init__(self, size, dtype, rng, period=10.0, amplitude=1000.0, offset=1000.0,
+                 phase=0.0, spread=0.0):
+        Generator.__init__(self, size, dtype, rng)
+        if float(period) <= 0:
+            raise TypeError("period must be positive")
+        self.period = float(period)
+        self.amplitude = float(amplitude)
+        self.offset = float(offset)
+        self.phases = phase + np.arange(size, dtype=np.float64) * (float(spread) / max(size, 1))
+
+    def generate(self, tick, t, out):
+        cycle = self._scratch
+        np.add(self.phases, t / self.period, out=cycle)
+        self.wave(cycle)
+        cycle *= self.amplitude
+        cycle += self.offset
+        self.store(cycle, out)
+
+    def generate_at(self, tick, t, positions, out):
+        cycle = self.phases[positions] + t / self.period
+        self.wave(cycle)
+        cycle *= self.amplitude
+        cycle += self.offset
+        self.store(cycle, out)
+
+    def wave(self, cycle):
+        # Map cycle positions to [-1, 1] in place.
+        raise NotImplementedError
+
+
+@register_generator("sine")
+class SineGenerator(WaveformGenerator):
+
+    def wave(self, cycle):
+        cycle *= 2 * np.pi
+        np.sin(cycle, out=cycle)
+
+
+@register_generator("sawtooth")
+class SawtoothGenerator(WaveformGenerator):
+
+    def wave(self, cycle):
+        np.mod(cycle, 1.0, out=cycle)
+        cycle *= 2
+        cycle -= 1
+
+
+@register_generator("ramp")
+class RampGenerator(Generator):
+    # Linear ramp from start_value to end_value over duration seconds,
+    # then hold end_value.
+
+    def __init__(self, size, dtype, rng, start_value=0.0, end_value=1000.0, duration=10.0,
+                 delay=0.0):
+        Generator.__init__(self, size, dtype, rng)
+        self.start_value = float(start_value)
+        self.end_value = float(end_value)
+        self.duration = max(float(duration), 1e-9)
+        self.delay = float(delay)
+
+    def generate(self, tick, t, out):
+        self._scratch.fill(self.level(t))
+        self.store(self._scratch, out)
+
+    def generate_at(self, tick, t, positions, out):
+        self.store(np.full(len(positions), self.level(t)), out)
+
+    def level(self, t):
+        progress = min(max((t - self.delay) / self.duration, 0.0), 1.0)
+        return self.start_value + (self.end_value - self.start_value) * progress
+
+
+@register_generator("random_walk")
+class RandomWalkGenerator(Generator):
+    # Each address drifts by a normal step per tick, bounded to [low, high].
+
+    def __init__(self, size, dtype, rng, initial=1000.0, step=10.0, low=0.0, high=32767.0):
+        Generator.__init__(self, size, dtype, rng)
+        self.step = float(step)
+        self.low = float(low)
+        self.high = float(high)
+        self.state = np.full(size, float(initial))
+
+    def get_state(self):
+        state = Generator.get_state(self)
+        state["walk"] = self.state.copy()
+        return state
+
+    def set_state(self, state):
+        Generator.set_state(self, state)
+        if len(state["walk"]) == self.size:
+            self.state[:] = state["walk"]
+
+    def generate(self, tick, t, out):
+        self.state += self.rng.normal(0.0, self.step, size=self.size)
+        np.clip(self.state, self.low, self.high, out=self.state)
+        np.copyto(self._scratch, self.state)
+        self.store(self._scratch, out)
+
+    def generate_at(self, tick, t, positions, out):
+        # Only the addresses that change take a step.
+        walk = self.state[positions] + self.rng.normal(0.0, self.step, size=len(positions))
+        np.clip(walk, self.low, self.high, out=walk)
+        self.state[positions] = walk
+        self.store(walk.copy(), out)
+
+
+@register_generator("noise")
+class NoiseGenerator(Generator):
+    # Gaussian noise around a fixed setpoint.
+
+    def __init__(self, size, dtype, rng, setpoint=1000.0, sigma=10.0):
+        Generator.__init__(self, size, dtype, rng)
+        self.setpoint = float(setpoint)
+        self.sigma = float(sigma)
+
+    def generate(self, tick, t, out):
+        self.rng.standard_normal(out=self._scratch)
+        self._scratch *= self.sigma
+        self._scratch += self.setpoint
+        self.store(self._scratch, out)
+
+    def generate_at(self, tick, t, positions, out):
+        signal = self.rng.standard_normal(len(positions))
+        signal *= self.sigma
+        signal += self.setpoint
+        self.store(signal, out)
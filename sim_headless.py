@@ -0,0 +1,212 @@
+"""Headless Modbus TCP server simulator.
+
+Runs the same simulator as slaveTCPsim.py without Tk, configured from a
+JSON/TOML/YAML file and/or command line flags. Flags override the
+file's top-level settings, which are the defaults for every entry of an
+optional "devices" list (see sim_config.parse_devices):
+
+    python sim_headless.py --config plant.yaml --port 1502 --engine asyncio
+    python sim_headless.py --holding 0:100 --coils 0:16 --word-mode incremental
+    python sim_headless.py --holding 0:1000 --word-mode inject --injections points.csv
+    python sim_headless.py --config plant.yaml --replay capture.mbt --replay-speed 10
+    python sim_headless.py --config plant.yaml --workers 4
+    python sim_headless.py --log-level DEBUG --log pymodbus=INFO --request-trace requests.jsonl
+"""
+import argparse
+import logging
+import signal
+import sys
+import threading
+from sim_config import ENGINES, TABLES, WORD_MODES, ConfigError, load_config_file, parse_devices
+from sim_injection import InjectionMap, load_injections_csv
+from sim_logging import DEFAULT_LOG_RATE, parse_levels, setup_logging
+from sim_scheduler import POLICIES
+from sim_server import Simulator
+from sim_state import StateError
+from sim_trace import TraceError
+
+log = logging.getLogger(__name__)
+
+
+def table_arg(value):
+    # "START:COUNT" -> {"start": START, "count": COUNT}
+    try:
+        start, count = value.split(":")
+        return {"start": int(start), "count": int(count)}
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected START:COUNT, got %r" % value)
+
+
+def interval_arg(value):
+    # "TABLE=SECONDS" -> (TABLE, SECONDS)
+    try:
+        name, seconds = value.split("=")
+        return name, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected TABLE=SECONDS, got %r" % value)
+
+
+def rate_arg(value):
+    # "TABLE=RATE" -> (TABLE, RATE); RATE is parsed by sim_config.
+    name, sep, rate = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected TABLE=RATE, got %r" % value)
+    return name, rate
+
+
+def level_arg(value):
+    # "LOGGER=LEVEL" -> (LOGGER, LEVEL)
+    name, sep, level = value.partition("=")
+    try:
+        if not sep:
+            raise ValueError(value)
+        return name, parse_levels({name: level})[name]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected LOGGER=LEVEL, got %r" % value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless Modbus TCP server simulator")
+    parser.add_argument("--config", help="JSON, TOML or YAML config file")
+    for name in TABLES:
+        parser.add_argument("--" + name, type=table_arg, metavar="START:COUNT",
+                            help="%s layout" % name)
+    parser.add_argument("--no-extra-count", dest="add_extra_count", action="store_false",
+                        default=None, help="do not add 1 to each table count")
+    parser.add_argument("--ip")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--slave-id", type=int)
+    parser.add_argument("--interval", dest="update_interval", type=float,
+                        help="update interval in seconds")
+    parser.add_argument("--table-interval", dest="table_intervals", type=interval_arg,
+                        action="append", metavar="TABLE=SECONDS",
+                        help="update interval of one table (repeatable)")
+    parser.add_argument("--change-rate", dest="change_rates", type=rate_arg, action="append",
+                        metavar="TABLE=RATE",
+                        help="regenerate only a fraction (0.05, 5%%) or count (50) of a table's "
+                             "addresses per tick (repeatable)")
+    parser.add_argument("--scheduler-policy", choices=POLICIES,
+                        help="what to do with ticks that miss their deadline")
+    parser.add_argument("--word-mode", choices=WORD_MODES)
+    parser.add_argument("--increment-step", type=int)
+    parser.add_argument("--increment-start", type=int)
+    parser.add_argument("--engine", choices=ENGINES)
+    parser.add_argument("--max-inflight", type=int,
+                        help="pipelined requests per connection taken in before answering")
+    parser.add_argument("--seed", type=int, help="seed for reproducible values")
+    parser.add_argument("--replay", dest="replay_file", metavar="TRACE",
+                        help="replay a register trace instead of generating values")
+    parser.add_argument("--replay-speed", type=float, help="replay speed factor, e.g. 10")
+    parser.add_argument("--no-replay-loop", dest="replay_loop", action="store_false",
+                        default=None, help="hold the last frame at the end of the trace")
+    parser.add_argument("--record", dest="record_file", metavar="TRACE",
+                        help="record every tick to a trace ({port} and {slave_id} expand)")
+    parser.add_argument("--state-file", metavar="PATH",
+                        help="save the plant state here and resume from it on startup")
+    parser.add_argument("--state-interval", type=float, metavar="SECONDS",
+                        help="seconds between state saves (0: on shutdown only)")
+    parser.add_argument("--no-restore", dest="state_restore", action="store_false",
+                        default=None, help="do not resume from an existing state file")
+    parser.add_argument("--write-hold", metavar="SECONDS|reset|off",
+                        help="how long client writes override generated values")
+    parser.add_argument("--scenario", metavar="FILE",
+                        help="scripted per-address behaviour (JSON, TOML or YAML)")
+    parser.add_argument("--injections", metavar="CSV",
+                        help="inject the table,address,value rows of a CSV file")
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics on this local port")
+    parser.add_argument("--control-port", type=int,
+                        help="serve the HTTP/JSON control API on this local port")
+    parser.add_argument("--request-trace", metavar="PATH",
+                        help="trace every served request to this JSON-lines file")
+    parser.add_argument("--workers", type=int,
+                        help="spread the ports over this many worker processes")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--log", dest="log_levels", type=level_arg, action="append",
+                        metavar="LOGGER=LEVEL",
+                        help="level of one subsystem, e.g. pymodbus=DEBUG (repeatable)")
+    parser.add_argument("--log-rate", type=float, default=DEFAULT_LOG_RATE,
+                        help="per-request log records per second and call site (0: unlimited)")
+    return parser
+
+
+def build_config(args):
+    raw = load_config_file(args.config) if args.config else {}
+    registers = dict(raw.get("registers") or {})
+    for name in TABLES:
+        if getattr(args, name) is not None:
+            registers[name] = getattr(args, name)
+    raw["registers"] = registers
+    if args.table_intervals:
+        intervals = dict(raw.get("table_intervals") or {})
+        intervals.update(args.table_intervals)
+        raw["table_intervals"] = intervals
+    if args.change_rates:
+        rates = dict(raw.get("change_rates") or {})
+        rates.update(args.change_rates)
+        raw["change_rates"] = rates
+    for key in ("add_extra_count", "ip", "port", "slave_id", "update_interval",
+                "word_mode", "increment_step", "increment_start", "engine", "max_inflight", "seed",
+                "metrics_port", "control_port", "request_trace", "scheduler_policy", "write_hold",
+                "scenario", "replay_file", "replay_speed", "replay_loop", "record_file", "state_file", "state_interval", "state_restore"):
+        if getattr(args, key) is not None:
+            raw[key] = getattr(args, key)
+    return parse_devices(raw)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    log_levels = dict(args.log_levels or ())
+    try:
+        setup_logging(args.log_level, log_levels, args.log_rate)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        configs = build_config(args)
+    except ConfigError as e:
+        log.error("%s", e)
+        return 2
+
+    injections = None
+    if args.injections:
+        try:
+            injections = {table: InjectionMap(values)
+                          for table, values in load_injections_csv(args.injections).items()}
+        except (OSError, ValueError) as e:
+            log.error("%s", e)
+            return 2
+    if args.workers:
+        if injections:
+            log.error("--injections is not supported with --workers")
+            return 2
+        if configs[0].state_file:
+            log.error("--state-file is not supported with --workers")
+            return 2
+        from sim_shard import ShardedSimulator
+        simulator = ShardedSimulator(configs, args.workers, log_levels, args.log_rate)
+    else:
+        try:
+            simulator = Simulator(configs, injections)
+        except (OSError, TraceError, StateError) as e:
+            log.error("%s", e)
+            return 2
+        for (ip, port), (engine, context) in simulator.endpoints.items():
+            log.info("Serving %d slave(s) on %s:%s (%s engine)",
+                     len(list(context.slaves())), ip, port, engine)
+
+    def handle_signal(signum, frame):
+        simulator.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    # Serve from a worker thread so the signal handler, which runs on the
+    # main thread, can block in stop() until the server loop has exited.
+    server_thread = threading.Thread(target=simulator.serve_forever)
+    server_thread.start()
+    while server_thread.is_alive():
+        server_thread.join(0.5)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
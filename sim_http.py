@@ -0,0 +1,123 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from sim_control import ControlError
+
+# Local HTTP endpoints of a Simulator: metrics (sim_metrics.Metrics) and the
+# control API (sim_control.CommandQueue). Imported when one is enabled, so
+# plain simulators never load the HTTP stack.
+
+log = logging.getLogger(__name__)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # GET /metrics (Prometheus text) or /metrics.json.
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(metrics.snapshot()).encode()
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = metrics.render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("metrics %s - %s", self.address_string(), format % args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, metrics, address):
+        self.metrics = metrics
+        ThreadingHTTPServer.__init__(self, address, MetricsRequestHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    # POST /commands with one command object or a list of them, e.g.
+    #
+    #   {"command": "fill", "table": "holding", "start": 0, "count": 100, "value": 7}
+    #
+    # answers {"results": [...]}. GET /dump?table=holding&start=0&count=10
+    # is a shorthand for the dump command. Errors answer 400 {"error": ...}.
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/commands":
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+        except ValueError:
+            self._reply(400, {"error": "Invalid JSON"})
+            return
+        self._run(body if isinstance(body, list) else [body])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/dump":
+            self.send_error(404)
+            return
+        args = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        args["command"] = "dump"
+        self._run([args])
+
+    def _run(self, commands):
+        try:
+            results = self.server.commands.submit(commands)
+        except ControlError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, {"results": results})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("control %s - %s", self.address_string(), format % args)
+
+
+class ControlServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, commands, address):
+        self.commands = commands
+        ThreadingHTTPServer.__init__(self, address, ControlRequestHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,116 @@
+import csv
+import threading
+
+# Tables accepted in injection files, also under their GUI labels.
+TABLE_ALIASES = {
+    "discrete": "discrete", "discrete inputs": "discrete", "di": "discrete",
+    "coils": "coils", "coil": "coils", "co": "coils",
+    "holding": "holding", "holding registers": "holding", "hr": "holding",
+    "input": "input", "input registers": "input", "ir": "input",
+}
+
+
+class InjectionMap(dict):
+    # {address: value} of the values forced onto one table every tick.
+    # Every change bumps `version`, so datablocks can keep a compiled
+    # index/value overlay and rebuild it only when the injections change
+    # (see NumpyDataBlock.inject). Mutations and items() copies are locked,
+    # as the GUI edits the map while the update thread compiles it.
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = 0
+        self._lock = threading.RLock()
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, address, value):
+        with self._lock:
+            dict.__setitem__(self, address, value)
+            self._changed()
+
+    def __delitem__(self, address):
+        with self._lock:
+            dict.__delitem__(self, address)
+            self._changed()
+
+    def pop(self, address, *default):
+        with self._lock:
+            value = dict.pop(self, address, *default)
+            self._changed()
+            return value
+
+    def update(self, *args, **kwargs):
+        with self._lock:
+            dict.update(self, *args, **kwargs)
+            self._changed()
+
+    def clear(self):
+        with self._lock:
+            dict.clear(self)
+            self._changed()
+
+    def set_range(self, start, count, value):
+        # Inject count consecutive addresses from start. value is one value
+        # for the whole range or a sequence of count values.
+        if isinstance(value, (list, tuple)):
+            if len(value) != count:
+                raise ValueError("expected %d values, got %d" % (count, len(value)))
+            values = value
+        else:
+            values = [value] * count
+        self.update(zip(range(start, start + count), values))
+
+    def clear_range(self, start, count):
+        with self._lock:
+            for address in range(start, start + count):
+                dict.pop(self, address, None)
+            self._changed()
+
+    def copy_items(self):
+        # (version, [(address, value), ...]) taken atomically.
+        with self._lock:
+            return self.version, list(dict.items(self))
+
+
+def parse_address_range(text):
+    # "100" -> (100, 1); "100-199" -> (100, 100). Raises ValueError.
+    text = text.strip()
+    if "-" in text:
+        first, last = (int(part) for part in text.split("-", 1))
+        if last < first:
+            raise ValueError("empty address range %r" % text)
+        return first, last - first + 1
+    return int(text), 1
+
+
+def load_injections_csv(path):
+    # Read injections from a CSV file with the columns
+    #
+    #   table,address,value
+    #   holding,100,1234
+    #   holding,200-299,0         (an address range)
+    #   coils,0-15,1
+    #
+    # "table" is a table name (discrete, coils, holding, input) or its GUI
+    # label. A header row is optional. Returns {table: {address: value}};
+    # raises ValueError with the offending line number.
+    injections = {}
+    with open(path, "r", newline="") as f:
+        for line, row in enumerate(csv.reader(f), 1):
+            if not row or not "".join(row).strip() or row[0].lstrip().startswith("#"):
+                continue
+            if line == 1 and row[0].strip().lower() == "table":
+                continue
+            try:
+                table = TABLE_ALIASES[row[0].strip().lower()]
+                start, count = parse_address_range(row[1])
+                value = int(row[2])
+            except (KeyError, IndexError, ValueError):
+                raise ValueError("%s line %d: expected table,address,value, got %r"
+                                 % (path, line, ",".join(row)))
+            table_injections = injections.setdefault(table, {})
+            for address in range(start, start + count):
+                table_injections[address] = value
+    return injections
@@ -0,0 +1,232 @@
+import atexit
+import collections
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Logging for the simulator processes. Records are queued by the thread
+# that logs them and formatted and written by one background thread, so
+# request handlers and the update loop never wait on a stream. The
+# per-request subsystems are rate limited before anything is queued.
+
+log = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Subsystem levels applied unless overridden: pymodbus logs (and hex dumps)
+# every frame at DEBUG.
+DEFAULT_LEVELS = {"pymodbus": "WARNING"}
+
+# Loggers whose records may come once per request, and the records per
+# second (per logger and call site) let through from them.
+RATE_LIMITED = ("pymodbus", "sim_engine")
+DEFAULT_LOG_RATE = 20.0
+
+# Request trace batches buffered before further ones are dropped, and the
+# seconds between writes.
+TRACE_BUFFER = 100000
+TRACE_FLUSH_INTERVAL = 0.5
+
+_listener = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler that only merges the message arguments on the logging
+    # thread; formatting (time stamp, layout) is left to the listener.
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    # Token bucket per (logger, call site) of the RATE_LIMITED subsystems:
+    # up to `rate` records per second with bursts of as many. Records above
+    # it are dropped before they are queued; the next record let through
+    # says how many were dropped. This applies at every level: pymodbus
+    # logs each exception response it builds as an error.
+
+    def __init__(self, rate=DEFAULT_LOG_RATE, prefixes=RATE_LIMITED):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.prefixes = tuple(prefixes)
+        self.suppressed = 0
+        self._buckets = {}      # {(logger, pathname, lineno): [tokens, last time, dropped]}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate or not record.name.startswith(self.prefixes):
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.rate, now, 0]
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = "%s (%d similar message(s) suppressed)" % (record.getMessage(), dropped)
+            record.args = None
+        return True
+
+
+def parse_levels(levels):
+    # "pymodbus=DEBUG,sim_engine=INFO" or {name: level} -> {name: LEVEL}.
+    if isinstance(levels, str):
+        items = [item.partition("=")[::2] for item in levels.split(",") if item.strip()]
+    else:
+        items = list((levels or {}).items())
+    parsed = {}
+    for name, level in items:
+        level = str(level).strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError("Invalid log level: %s" % level)
+        parsed[name.strip()] = level
+    return parsed
+
+
+def setup_logging(level="INFO", levels=None, rate=DEFAULT_LOG_RATE, fmt=LOG_FORMAT):
+    # Route the root logger through a queue to a background writer on
+    # stderr. levels: {logger name: level} over DEFAULT_LEVELS; rate:
+    # records per second per call site of the per-request subsystems
+    # (0 for no limit). Returns the QueueListener; it is stopped (and the
+    # queue flushed) at exit.
+    global _listener
+    stop_logging()
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(RateLimitFilter(rate))
+    writer = logging.StreamHandler()
+    writer.setFormatter(logging.Formatter(fmt))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level if isinstance(level, int) else str(level).upper())
+    for name, subsystem_level in dict(DEFAULT_LEVELS, **parse_levels(levels)).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def set_level(name, level):
+    # Change the level of one logger ("" or "root" for the root logger).
+    level = parse_levels({name: level})[name]
+    logging.getLogger(None if name in ("", "root") else name).setLevel(level)
+    return level
+
+
+class RequestTrace(object):
+    # Optional JSON-lines trace of served requests, one line each:
+    #
+    #   {"t": 1700000000.123456, "peer": "127.0.0.1:50312", "unit": 1, "tid": 7,
+    #    "fc": 3, "address": 0, "count": 10, "exception": null, "batch_us": 42}
+    #
+    # It can be switched on and off while serving (control API "trace"
+    # command). The engines check `enabled` and hand over their batches;
+    # lines are built and written by a background thread, and while it is
+    # TRACE_BUFFER batches behind, new requests are dropped and counted.
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.records = 0
+        self.dropped = 0
+        self._pending = collections.deque()
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, peer, requests, responses, seconds):
+        # Called by the engines for every executed batch while enabled.
+        pending = self._pending
+        if len(pending) >= TRACE_BUFFER:
+            self.dropped += len(requests)
+            return
+        pending.append((time.time(), peer, requests, responses, seconds))
+
+    def enable(self, path):
+        with self._lock:
+            if self.enabled:
+                self._close()
+            self._file = open(os.path.expanduser(path), "a")
+            self.path = path
+            # Batches handed over after the previous trace was closed.
+            self._pending.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="request-trace")
+            self._thread.daemon = True
+            self._thread.start()
+            self.enabled = True
+        log.info("Tracing requests to %s", path)
+
+    def disable(self):
+        with self._lock:
+            if self.enabled:
+                self._close()
+                log.info("Stopped tracing requests to %s", self.path)
+
+    def _close(self):
+        self.enabled = False
+        self._stop.set()
+        self._thread.join()
+        self._write()
+        self._file.close()
+        self._file = None
+
+    def status(self):
+        return {"enabled": self.enabled, "path": self.path, "records": self.records,
+                "dropped": self.dropped}
+
+    def _run(self):
+        while not self._stop.wait(TRACE_FLUSH_INTERVAL):
+            self._write()
+
+    def _write(self):
+        lines = []
+        pending = self._pending
+        while pending:
+            t, peer, requests, responses, seconds = pending.popleft()
+            batch_us = int(seconds * 1e6)
+            for request, response in zip(requests, responses):
+                exception = getattr(response, "exception_code", None) \
+                    if response.function_code & 0x80 else None
+                lines.append(json.dumps({
+                    "t": round(t, 6), "peer": peer, "unit": request.unit_id,
+                    "tid": request.transaction_id, "fc": request.function_code,
+                    "address": getattr(request, "address", None),
+                    "count": getattr(request, "count", 1), "exception": exception,
+                    "batch_us": batch_us}))
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.records += len(lines)
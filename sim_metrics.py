@@ -0,0 +1,180 @@
+import bisect
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (request latency, tick timing).
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Modbus exception code for requests outside the register map.
+ILLEGAL_ADDRESS = 2
+
+
+class Histogram(object):
+    # Fixed-bucket histogram; observe() is a bisect and three additions
+    # under an uncontended lock.
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile (approximate).
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics(object):
+    # Counters and histograms for one Simulator. The serving engines call
+    # the connection/request hooks, the update loop calls observe_tick().
+
+    def __init__(self):
+        self.started = time.time()
+        self.request_latency = {}       # {function code: Histogram}
+        self.exceptions = {}            # {(function code, exception code): count}
+        self.connections = 0
+        self.connections_total = 0
+        self.tick_duration = Histogram()
+        self.tick_lateness = Histogram()
+        self.ticks = 0
+        self.tick_overruns = 0
+        # TickScheduler whose per-task rates and jitter are reported, if any.
+        self.scheduler = None
+        self._lock = threading.Lock()
+
+    # ----------------- Hooks -----------------
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections -= 1
+
+    def observe_request(self, response, seconds):
+        function_code = response.function_code & 0x7F
+        histogram = self.request_latency.get(function_code)
+        if histogram is None:
+            histogram = self.request_latency.setdefault(function_code, Histogram())
+        histogram.observe(seconds)
+        if response.function_code & 0x80:
+            key = (function_code, getattr(response, "exception_code", 0))
+            with self._lock:
+                self.exceptions[key] = self.exceptions.get(key, 0) + 1
+
+    def observe_tick(self, duration, lateness, interval):
+        self.tick_duration.observe(duration)
+        self.tick_lateness.observe(lateness)
+        with self._lock:
+            self.ticks += 1
+            if duration > interval:
+                self.tick_overruns += 1
+
+    # ----------------- Reports -----------------
+
+    def _copies(self):
+        # Copies that are safe to iterate while handlers keep recording.
+        with self._lock:
+            exceptions = dict(self.exceptions)
+        return dict(self.request_latency), exceptions
+
+    def snapshot(self):
+        # Plain dict for the GUI stats panel and the JSON endpoint.
+        request_latency, exceptions = self._copies()
+        latencies = list(request_latency.values())
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "requests_total": sum(h.count for h in latencies),
+            "exceptions_total": sum(exceptions.values()),
+            "illegal_address_total": sum(count for (_, code), count in exceptions.items()
+                                         if code == ILLEGAL_ADDRESS),
+            "connections": self.connections,
+            "connections_total": self.connections_total,
+            "request_latency_p50": max([h.quantile(0.5) for h in latencies] or [0.0]),
+            "request_latency_p99": max([h.quantile(0.99) for h in latencies] or [0.0]),
+            "requests_by_function": {str(fc): h.count for fc, h in sorted(request_latency.items())},
+            "ticks_total": self.ticks,
+            "tick_overruns_total": self.tick_overruns,
+            "tick_duration_mean": self.tick_duration.mean(),
+            "tick_lateness_mean": self.tick_lateness.mean(),
+            "scheduler": self.scheduler.report() if self.scheduler is not None else [],
+        }
+
+    def render_prometheus(self):
+        request_latency, exceptions = self._copies()
+        lines = []
+
+        def histogram(name, hist, labels=""):
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append('%s_bucket{%s%sle="%g"} %d' % (name, labels, sep, bound, cumulative))
+            lines.append('%s_bucket{%s%sle="+Inf"} %d' % (name, labels, sep, hist.count))
+            lines.append("%s_sum%s %.9f" % (name, "{%s}" % labels if labels else "", hist.total))
+            lines.append("%s_count%s %d" % (name, "{%s}" % labels if labels else "", hist.count))
+
+        lines.append("# HELP modbus_request_seconds Request handling latency by function code.")
+        lines.append("# TYPE modbus_request_seconds histogram")
+        for fc, hist in sorted(request_latency.items()):
+            histogram("modbus_request_seconds", hist, 'function_code="%d"' % fc)
+        lines.append("# HELP modbus_exceptions_total Exception responses by function and exception code.")
+        lines.append("# TYPE modbus_exceptions_total counter")
+        for (fc, code), count in sorted(exceptions.items()):
+            lines.append('modbus_exceptions_total{function_code="%d",exception_code="%d"} %d'
+                         % (fc, code, count))
+        lines.append("# HELP modbus_connections Open client connections.")
+        lines.append("# TYPE modbus_connections gauge")
+        lines.append("modbus_connections %d" % self.connections)
+        lines.append("# HELP modbus_connections_total Accepted client connections.")
+        lines.append("# TYPE modbus_connections_total counter")
+        lines.append("modbus_connections_total %d" % self.connections_total)
+        lines.append("# HELP simulator_tick_seconds Time spent generating one device tick.")
+        lines.append("# TYPE simulator_tick_seconds histogram")
+        histogram("simulator_tick_seconds", self.tick_duration)
+        lines.append("# HELP simulator_tick_lateness_seconds Delay between a tick's deadline and its start.")
+        lines.append("# TYPE simulator_tick_lateness_seconds histogram")
+        histogram("simulator_tick_lateness_seconds", self.tick_lateness)
+        lines.append("# HELP simulator_tick_overruns_total Ticks that took longer than their interval.")
+        lines.append("# TYPE simulator_tick_overruns_total counter")
+        lines.append("simulator_tick_overruns_total %d" % self.tick_overruns)
+        if self.scheduler is not None:
+            reports = self.scheduler.report()
+            for name, kind, key, help_text in (
+                    ("simulator_tick_rate_hz", "gauge", "achieved_hz", "Achieved tick rate per task."),
+                    ("simulator_tick_jitter_seconds", "gauge", "jitter",
+                     "Standard deviation of tick start lateness per task."),
+                    ("simulator_ticks_skipped_total", "counter", "skipped",
+                     "Ticks dropped after a missed deadline per task."),
+                    ("simulator_tick_failures_total", "counter", "failures",
+                     "Ticks that raised an exception per task.")):
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for report in reports:
+                    lines.append('%s{task="%s"} %s' % (name, report["task"], report[key]))
+        return "\n".join(lines) + "\n"
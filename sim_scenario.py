@@ -0,0 +1,325 @@
+import logging
+import operator
+from dataclasses import dataclass, field
+
+import numpy as np
+from sim_config import TABLES, ConfigError
+from sim_datastore import BIT
+from sim_generators import WORD_MAX
+from sim_injection import TABLE_ALIASES, parse_address_range
+
+log = logging.getLogger(__name__)
+
+# Scenarios script individual addresses over time, on top of whatever the
+# word mode and generators produce:
+#
+#   scenario:
+#     loop: 120                 # restart every 120 s; omit to play once
+#     events:
+#       - {at: 0, table: holding, address: 100, ramp: [0, 1000], duration: 30}
+#       - {at: 30, table: coils, address: 5, set: 1}
+#       - {at: 60, table: coils, address: 5, release: true}
+#       - {table: holding, address: 200, latch: 1, when: "holding 100 >= 900"}
+#
+# "address" is an address or a "first-last" range. An address follows the
+# latest of its events that has started: set holds a value, ramp goes
+# linearly from its first value (default: the previous event's value, else
+# 0) to its second over duration seconds and then holds it, release hands
+# the address back to the generators. A latch writes its value from the
+# first tick its condition holds (at or after "at") until the scenario
+# restarts; conditions compare one address with a number (>, >=, <, <=,
+# ==, !=) and see the tables as generated so far in the tick (TABLES
+# order), the others as last published.
+#
+# ScenarioPlan compiles the events of a device into per-table arrays, so a
+# tick costs a few vectorized operations per table however many addresses
+# are scripted.
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+             "==": operator.eq, "!=": operator.ne}
+KINDS = ("set", "ramp", "release", "latch")
+
+
+@dataclass
+class Scenario:
+    # Parsed events, see parse_scenario(); loop is the period in seconds or
+    # None to play once.
+    events: list = field(default_factory=list)
+    loop: float = None
+
+
+def parse_scenario(raw):
+    # Scenario from a config mapping {"events": [...], "loop": ...}. Raises
+    # ConfigError with the offending event.
+    if not isinstance(raw, dict) or not isinstance(raw.get("events"), list):
+        raise ConfigError("A scenario must be a mapping with a list of events")
+    loop = raw.get("loop")
+    if loop in (None, False):
+        loop = None
+    else:
+        try:
+            loop = float(loop)
+        except (TypeError, ValueError):
+            loop = 0.0
+        if loop <= 0:
+            raise ConfigError("Invalid scenario loop period: %s" % raw.get("loop"))
+    events = []
+    for index, event in enumerate(raw["events"]):
+        try:
+            events.append(_parse_event(event))
+        except (TypeError, ValueError, KeyError) as e:
+            raise ConfigError("Invalid scenario event %d (%s): %s" % (index + 1, event, e))
+    return Scenario(events, loop)
+
+
+def _table(name):
+    table = TABLE_ALIASES.get(str(name).strip().lower())
+    if table is None:
+        raise ValueError("unknown table %s" % name)
+    return table
+
+
+def _parse_event(raw):
+    if not isinstance(raw, dict):
+        raise ValueError("not a mapping")
+    kinds = [kind for kind in KINDS if kind in raw]
+    if len(kinds) != 1:
+        raise ValueError("expected one of %s" % ", ".join(KINDS))
+    kind = kinds[0]
+    start, count = parse_address_range(str(raw["address"]))
+    event = {"kind": kind, "table": _table(raw["table"]), "start": start, "count": count,
+             "at": float(raw.get("at", 0.0)), "from": None, "value": None, "duration": 0.0,
+             "when": None}
+    if event["at"] < 0:
+        raise ValueError("negative time")
+    if kind == "set" or kind == "latch":
+        event["value"] = float(raw[kind])
+    elif kind == "ramp":
+        ramp = raw["ramp"]
+        if isinstance(ramp, (list, tuple)):
+            event["from"], event["value"] = float(ramp[0]), float(ramp[1])
+        else:
+            event["value"] = float(ramp)
+        event["duration"] = float(raw["duration"])
+        if event["duration"] <= 0:
+            raise ValueError("a ramp needs a positive duration")
+    if kind == "latch":
+        event["when"] = _parse_condition(raw["when"])
+    return event
+
+
+def _parse_condition(raw):
+    # "holding 100 >= 900" or {"table", "address", "op", "value"} ->
+    # (table, address, op, value).
+    if isinstance(raw, str):
+        table, address, op, value = raw.split()
+    else:
+        table, address, op, value = raw["table"], raw["address"], raw["op"], raw["value"]
+    if op not in OPERATORS:
+        raise ValueError("unknown operator %s" % op)
+    return _table(table), int(address), op, float(value)
+
+
+class ScenarioPlan(object):
+    # A Scenario compiled against one device's blocks. apply(name, block, t)
+    # writes the scripted values of one table after its generators ran and
+    # returns the positions written.
+
+    def __init__(self, scenario, blocks):
+        self.loop = scenario.loop
+        self.tables = {}
+        for name in TABLES:
+            events = [event for event in scenario.events if event["table"] == name]
+            latches = [event for event in events if event["kind"] == "latch"]
+            timed = [event for event in events if event["kind"] != "latch"]
+            if not events:
+                continue
+            table = TableScenario(name, blocks[name], timed, latches, blocks)
+            if table.size or len(table.latch_positions):
+                self.tables[name] = table
+
+    def apply(self, name, block, t):
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        if self.loop is not None:
+            t = t % self.loop
+        return table.apply(block, t)
+
+    def get_state(self):
+        return {name: table.latched.copy() for name, table in self.tables.items()}
+
+    def set_state(self, state):
+        for name, table in self.tables.items():
+            latched = state.get(name)
+            if latched is not None and len(latched) == len(table.latched):
+                table.restore_latches(latched)
+
+
+class TableScenario(object):
+    # The compiled events of one table.
+    #
+    # Timed events become segments over the table's scripted positions
+    # ("slots"): start time, end time, first and last value and a release
+    # flag, sorted by start time. The segments started by time t are a
+    # prefix of that order; each slot follows the last started segment of
+    # its own, kept in `current` and advanced as the prefix grows. Values
+    # are recomputed only after a segment started or while a ramp has not
+    # been computed at its end, else the previous values are scattered again.
+    #
+    # Latches are arrays of target positions and values with their
+    # conditions' source positions, operators and thresholds.
+
+    def __init__(self, name, block, timed, latches, blocks):
+        self.name = name
+        self.bits = block.values.dtype == BIT
+        # Timed segments, one per event and address.
+        slot_of = {}
+        rows = []
+        last_value = {}
+        for order, event in sorted(enumerate(timed), key=lambda item: (item[1]["at"], item[0])):
+            positions = self._positions(block, event)
+            for position in positions.tolist():
+                slot = slot_of.setdefault(position, len(slot_of))
+                first = event["from"]
+                if first is None:
+                    first = last_value.get(position, 0.0)
+                value = event["value"]
+                if event["kind"] == "release":
+                    first = value = np.nan
+                elif event["kind"] == "set":
+                    first = value
+                last_value[position] = 0.0 if value != value else value
+                rows.append((event["at"], event["at"] + event["duration"], first, value, slot))
+        self.positions = np.array(sorted(slot_of, key=slot_of.get), dtype=np.int64)
+        self.size = len(self.positions)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        self.seg_start = rows[:, 0].copy()
+        self.seg_end = rows[:, 1].copy()
+        self.seg_first = rows[:, 2].copy()
+        self.seg_last = rows[:, 3].copy()
+        self.seg_slot = rows[:, 4].astype(np.int64)
+        self.seg_release = np.isnan(self.seg_last)
+        self.seg_duration = np.maximum(self.seg_end - self.seg_start, 1e-9)
+
+        # Latches, one per event and target address.
+        targets, values, armed, sources = [], [], [], []
+        for event in latches:
+            positions = self._positions(block, event)
+            source_table, address, op, threshold = event["when"]
+            source, in_range = blocks[source_table].offsets([address])
+            if not in_range[0]:
+                log.warning("Scenario condition address %s is not in the %s table", address,
+                            source_table)
+                continue
+            for position in positions.tolist():
+                targets.append(position)
+                values.append(event["value"])
+                armed.append(event["at"])
+                sources.append((source_table, int(source[0]), op, event["when"][3]))
+        self.latch_positions = np.array(targets, dtype=np.int64)
+        self.latch_values = self._store(np.array(values, dtype=np.float64))
+        self.latch_armed = np.array(armed, dtype=np.float64)
+        self.latched = np.zeros(len(targets), dtype=bool)
+        # Conditions grouped by (source table, operator): [(table, op,
+        # latch indices, source positions, thresholds)].
+        groups = {}
+        for index, (source_table, position, op, threshold) in enumerate(sources):
+            groups.setdefault((source_table, op), []).append((index, position, threshold))
+        self.conditions = [
+            (source_table, OPERATORS[op], np.array([item[0] for item in items], dtype=np.int64),
+             np.array([item[1] for item in items], dtype=np.int64),
+             np.array([item[2] for item in items], dtype=np.float64))
+            for (source_table, op), items in groups.items()
+        ]
+        self.blocks = blocks
+        self.reset()
+
+    def _positions(self, block, event):
+        positions, in_range = block.offsets(np.arange(event["start"], event["start"] + event["count"]))
+        if not in_range.all():
+            log.warning("Scenario %s of %s %s+%s is partly outside the table", event["kind"],
+                        self.name, event["start"], event["count"])
+        return positions[in_range]
+
+    def reset(self):
+        # Back to time 0: no segment started, no latch tripped.
+        self.current = np.full(self.size, -1, dtype=np.int64)
+        self.started = 0
+        self.last_t = -1.0
+        self.settled = -np.inf
+        self.active_slots = np.zeros(0, dtype=np.int64)
+        self.active_positions = self.active_slots
+        self.active_values = None
+        self.values_t = -np.inf
+        self.latched.fill(False)
+        self.latched_positions = self.active_slots
+        self.latched_values = None
+        self.written = self.active_slots
+
+    def restore_latches(self, latched):
+        self.latched[:] = latched
+        self.latched_positions = self.latch_positions[self.latched]
+        self.latched_values = self.latch_values[self.latched]
+        self.written = np.union1d(self.active_positions, self.latched_positions)
+
+    def _store(self, signal):
+        # Float values in the table's dtype, as Generator.store().
+        if self.bits:
+            return signal >= 0.5
+        return np.clip(np.rint(signal), 0, WORD_MAX).astype(np.uint16)
+
+    def apply(self, block, t):
+        if t < self.last_t:
+            self.reset()
+        changed = self.size and self._advance(t)
+        if len(self.active_positions):
+            block.values[self.active_positions] = self.active_values
+        if len(self.latch_positions) and self._latch(t):
+            self.latched_positions = self.latch_positions[self.latched]
+            self.latched_values = self.latch_values[self.latched]
+            changed = True
+        if len(self.latched_positions):
+            block.values[self.latched_positions] = self.latched_values
+        self.last_t = t
+        if changed:
+            self.written = np.union1d(self.active_positions, self.latched_positions)
+        return self.written if len(self.written) else None
+
+    def _advance(self, t):
+        started = int(np.searchsorted(self.seg_start, t, side="right"))
+        changed = started != self.started
+        if changed:
+            # Each slot follows its last started segment: with the new
+            # segments reversed, np.unique finds every slot's last one.
+            new = np.arange(self.started, started)[::-1]
+            slots, first = np.unique(self.seg_slot[new], return_index=True)
+            self.current[slots] = new[first]
+            self.started = started
+            active = self.current >= 0
+            active[active] = ~self.seg_release[self.current[active]]
+            self.active_slots = np.flatnonzero(active)
+            self.active_positions = self.positions[self.active_slots]
+            segments = self.current[self.active_slots]
+            self.settled = self.seg_end[segments].max() if len(segments) else -np.inf
+        if changed or self.values_t < self.settled or self.active_values is None:
+            self.values_t = t
+            segments = self.current[self.active_slots]
+            progress = np.clip((t - self.seg_start[segments]) / self.seg_duration[segments], 0.0, 1.0)
+            first = self.seg_first[segments]
+            self.active_values = self._store(first + (self.seg_last[segments] - first) * progress)
+        return changed
+
+    def _latch(self, t):
+        # Trip the armed latches whose condition holds; True if any did.
+        pending = ~self.latched & (self.latch_armed <= t)
+        if not pending.any():
+            return False
+        tripped = False
+        for source_table, compare, indices, positions, thresholds in self.conditions:
+            values = self.blocks[source_table].values[positions].astype(np.float64)
+            trip = pending[indices] & compare(values, thresholds)
+            if trip.any():
+                self.latched[indices[trip]] = True
+                tripped = True
+        return tripped
@@ -0,0 +1,146 @@
+import heapq
+import logging
+import math
+import time
+
+log = logging.getLogger(__name__)
+
+# Overrun policies.
+# "skip":     drop the ticks whose deadline has already passed and resume on
+#             the original grid, so the period never compresses.
+# "catch-up": run every missed tick back to back until on schedule again
+#             (bounded by MAX_CATCH_UP, after which it skips).
+POLICIES = ("skip", "catch-up")
+DEFAULT_POLICY = "skip"
+MAX_CATCH_UP = 100
+
+
+class ScheduledTask(object):
+    # A periodic callback with its deadline and timing statistics.
+
+    def __init__(self, name, interval, callback):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.deadline = 0.0
+        self.started = None
+        self.last = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.failures = 0
+        # Running sums of the start lateness for mean and jitter (std dev).
+        self._late_sum = 0.0
+        self._late_sq_sum = 0.0
+        self.late_max = 0.0
+
+    def record(self, start, lateness, duration):
+        if self.ticks == 0:
+            self.started = start
+        self.last = start
+        self.ticks += 1
+        self._late_sum += lateness
+        self._late_sq_sum += lateness * lateness
+        if lateness > self.late_max:
+            self.late_max = lateness
+        if duration > self.interval:
+            self.overruns += 1
+
+    def report(self):
+        # Achieved rate over the ticks started so far, first to last.
+        elapsed = self.last - self.started if self.ticks > 1 else 0.0
+        mean = self._late_sum / self.ticks if self.ticks else 0.0
+        variance = self._late_sq_sum / self.ticks - mean * mean if self.ticks else 0.0
+        return {
+            "task": self.name,
+            "interval": self.interval,
+            "target_hz": 1.0 / self.interval if self.interval > 0 else None,
+            "achieved_hz": (self.ticks - 1) / elapsed if elapsed > 0 else 0.0,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "lateness_mean": mean,
+            "lateness_max": self.late_max,
+            "jitter": math.sqrt(max(variance, 0.0)),
+        }
+
+
+class TickScheduler(object):
+    # Deadline-based scheduler for periodic tasks on the monotonic clock.
+    # Deadlines advance by exact multiples of the interval from the first
+    # tick, so the work time never adds to the period. One thread runs all
+    # tasks, earliest deadline first.
+
+    def __init__(self, policy=DEFAULT_POLICY, spin=0.0, on_tick=None, before_tick=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown scheduler policy: %s" % policy)
+        self.policy = policy
+        # Busy-wait the last `spin` seconds before a deadline for sub-ms
+        # accuracy, at the cost of some CPU.
+        self.spin = spin
+        # on_tick(task, duration, lateness) is called after every tick.
+        self.on_tick = on_tick
+        # before_tick() is called before every tick, e.g. to apply queued
+        # control commands on the scheduler thread.
+        self.before_tick = before_tick
+        self.tasks = []
+
+    def add(self, name, interval, callback):
+        task = ScheduledTask(name, max(float(interval), 0.0), callback)
+        self.tasks.append(task)
+        return task
+
+    def run(self, stop_event):
+        now = time.monotonic()
+        queue = []
+        for index, task in enumerate(self.tasks):
+            task.deadline = now
+            queue.append((now, index))
+        heapq.heapify(queue)
+        while queue and not stop_event.is_set():
+            deadline, index = queue[0]
+            now = time.monotonic()
+            if deadline > now:
+                remaining = deadline - now
+                if remaining > self.spin:
+                    stop_event.wait(remaining - self.spin)
+                    continue
+                while time.monotonic() < deadline:
+                    pass
+                now = time.monotonic()
+            task = self.tasks[index]
+            try:
+                if self.before_tick is not None:
+                    self.before_tick()
+                task.callback()
+            except Exception:
+                # One failed tick must not stop the update loop. The first
+                # failure of a task is logged, the others only counted.
+                task.failures += 1
+                if task.failures == 1:
+                    log.exception("Tick of %s failed", task.name)
+            finished = time.monotonic()
+            lateness = now - deadline
+            duration = finished - now
+            task.record(now, lateness, duration)
+            if self.on_tick is not None:
+                self.on_tick(task, duration, lateness)
+            task.deadline = self._next_deadline(task, deadline, finished)
+            heapq.heapreplace(queue, (task.deadline, index))
+
+    def _next_deadline(self, task, deadline, now):
+        if task.interval <= 0:
+            return now
+        deadline += task.interval
+        if deadline >= now:
+            return deadline
+        missed = int((now - deadline) // task.interval) + 1
+        if self.policy == "catch-up" and missed <= MAX_CATCH_UP:
+            return deadline
+        # Skip the missed ticks but stay on the original grid.
+        task.skipped += missed
+        return deadline + missed * task.interval
+
+    def report(self):
+        return [task.report() for task in self.tasks]
@@ -0,0 +1,535 @@
+import functools
+import logging
+import threading
+import time
+import numpy as np
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from sim_config import TABLES
+from sim_control import CommandQueue
+from sim_datastore import BIT, WORD, SnapshotStore, create_block
+from sim_engine import create_server
+from sim_generators import create_generator
+from sim_injection import InjectionMap
+from sim_logging import RequestTrace
+from sim_metrics import Metrics
+from sim_scenario import ScenarioPlan
+from sim_scheduler import DEFAULT_POLICY, TickScheduler
+from sim_state import StateSaver, restore_devices
+from sim_trace import TraceRecorder, TraceReplay, trace_path
+
+log = logging.getLogger(__name__)
+
+# Entropy tag of the sparse-update rng stream (see SimDevice.change_rng).
+CHANGE_STREAM = 1
+
+
+class SimDevice(object):
+    # One simulated slave: its register blocks, injections and generation
+    # state for one SimConfig. Devices hold no threads of their own; the
+    # Simulator's scheduler calls update_registers() when they are due.
+
+    def __init__(self, config, injections=None, store_factory=SnapshotStore):
+        self.config = config
+        self.word_mode = config.word_mode
+        # Ticks generated so far per table; tables may run at different rates.
+        self.ticks = {name: 0 for name in TABLES}
+
+        # Confirmed injections per table: {address: value}. Callers may pass
+        # their own maps to keep injections made before the server started;
+        # InjectionMaps are compiled once per change, plain dicts every tick.
+        injections = injections or {}
+        self.injection_holding = _injection_map(injections, "holding")
+        self.injection_input = _injection_map(injections, "input")
+        self.injection_coils = _injection_map(injections, "coils")
+        self.injection_discrete = _injection_map(injections, "discrete")
+        self.injections = {
+            "discrete": self.injection_discrete,
+            "coils": self.injection_coils,
+            "holding": self.injection_holding,
+            "input": self.injection_input,
+        }
+
+        # Generation state. The seed sequence is keyed by port and slave ID
+        # so a seeded plant replays identically whatever the device order.
+        self.seed_sequence = np.random.SeedSequence(config.seed,
+                                                    spawn_key=(config.port, config.slave_id))
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        self.plan = None
+        self.plan_mode = None
+        # Sparse updates pick the addresses to change with their own rng. It
+        # comes from a separate sequence (the seed extended with a stream
+        # tag), not from seed_sequence: spawning from that would shift the
+        # generator seeds build_plan() takes, so a change rate on one table
+        # would alter the seeded values of all the others.
+        self.change_rng = (np.random.default_rng(np.random.SeedSequence(
+            None if config.seed is None else [config.seed, CHANGE_STREAM],
+            spawn_key=(config.port, config.slave_id)))
+            if config.change_rates else None)
+        # Positions changed by the last update per table (sorted arrays), or
+        # None when the whole table may have changed; see changed_addresses().
+        self.changed = {name: None for name in TABLES}
+
+        # Create register blocks.
+        tables = config.tables
+        self.coils = create_block(tables["coils"].segments, BIT)
+        self.discrete_inputs = create_block(tables["discrete"].segments, BIT)
+        self.input_registers = create_block(tables["input"].segments, WORD)
+        self.holding_registers = create_block(tables["holding"].segments, WORD)
+        self.holding_registers.fill_random(self.rng)
+        # Client writes to the writable tables stick over generated values.
+        if config.write_hold != 0:
+            self.coils.track_writes(config.write_hold)
+            self.holding_registers.track_writes(config.write_hold)
+        # store_factory(blocks) -> SnapshotStore; sharded workers pass one
+        # that keeps the images in shared memory.
+        self.store = store_factory(self.blocks())
+
+        # Trace replay and recording (see sim_trace.py).
+        self.replay = None
+        self.recorder = None
+        self.record_started = None
+        # Set by a StateSaver (see sim_state.py) to get capture_state() after
+        # the next tick.
+        self.capture_requested = None
+        if config.replay_file:
+            self.replay = TraceReplay(trace_path(config.replay_file, config),
+                                      config.replay_speed, config.replay_loop)
+        if config.record_file:
+            self.recorder = TraceRecorder(trace_path(config.record_file, config), self.blocks())
+        # Scripted addresses, written over the generated values every tick.
+        self.scenario = ScenarioPlan(config.scenario, self.blocks()) if config.scenario else None
+
+        self.context = ModbusSlaveContext(
+            co=self.coils,
+            di=self.discrete_inputs,
+            hr=self.holding_registers,
+            ir=self.input_registers
+        )
+
+    def blocks(self):
+        # {table name: datablock}, keyed like SimConfig.tables.
+        return {
+            "discrete": self.discrete_inputs,
+            "coils": self.coils,
+            "holding": self.holding_registers,
+            "input": self.input_registers,
+        }
+
+    def table_interval(self, name):
+        return self.config.table_intervals.get(name, self.config.update_interval)
+
+    def schedule_groups(self):
+        # {interval: [table names]}: tables updated together by one task.
+        groups = {}
+        for name in TABLES:
+            groups.setdefault(self.table_interval(name), []).append(name)
+        return groups
+
+    def update_registers(self, tables=TABLES):
+        # The new values are built in the store's back buffer and published
+        # in one step, so readers always see a whole tick. Only the tables
+        # updated now are copied into it.
+        self.store.begin(tables)
+        try:
+            self.generate(tables)
+        finally:
+            self.store.publish()
+        if self.recorder is not None:
+            now = time.monotonic()
+            if self.record_started is None:
+                self.record_started = now
+            self.recorder.record(now - self.record_started, self.store.current.tables, self.changed)
+        saver = self.capture_requested
+        if saver is not None:
+            self.capture_requested = None
+            saver.deliver(self, self.capture_state())
+
+    def generate(self, tables=TABLES):
+        # Run the plan of each table once, then the scenario, then put back
+        # held client writes and apply the injections, which win over all.
+        # Tables with a change rate only regenerate the addresses picked for
+        # this tick.
+        if self.plan is None or self.plan_mode != self.word_mode:
+            self.build_plan()
+        blocks = self.blocks()
+        for name, block in blocks.items():
+            # Client writes since the last update change every table.
+            changed = [block.take_written()]
+            if name not in tables:
+                self.changed[name] = changed[0]
+                continue
+            tick = self.ticks[name]
+            t = tick * self.table_interval(name)
+            rate = self.config.change_rates.get(name)
+            if self.replay is not None and name in self.replay.reader.tables:
+                # Traced tables are replayed instead of generated.
+                self.replay.advance(t)
+                self.replay.apply(name, block)
+                changed = None
+            elif rate is not None:
+                changed.append(self.generate_sparse(name, tick, t, rate))
+            else:
+                for _, selector, generator, buffer in self.plan[name]:
+                    if buffer is None:
+                        generator.generate(tick, t, block.values[selector])
+                    else:
+                        generator.generate(tick, t, buffer)
+                        block.values[selector] = buffer
+                changed = None
+            if self.scenario is not None:
+                scripted = self.scenario.apply(name, block, t)
+                if changed is not None and scripted is not None:
+                    changed.append(scripted)
+            self.ticks[name] = tick + 1
+            block.apply_writes()
+            injected = block.inject(self.injections[name])
+            if changed is not None and injected is not None:
+                changed.append(injected)
+            self.changed[name] = None if changed is None else np.unique(np.concatenate(changed))
+
+    def generate_sparse(self, name, tick, t, rate):
+        # Regenerate rate (a fraction or a count) of the table's positions,
+        # picked at random in time proportional to their number; returns
+        # the sorted positions. Each plan entry generates the picked
+        # positions it owns, later entries winning as in a full update.
+        size = len(self.blocks()[name].values)
+        if isinstance(rate, float):
+            count = self.change_rng.binomial(size, rate)
+        else:
+            count = min(rate, size)
+        positions = np.sort(self.change_rng.choice(size, count, replace=False))
+        for block, selector, generator, _ in self.plan[name]:
+            if isinstance(selector, slice):
+                start = selector.start or 0
+                first, last = np.searchsorted(positions, [start, size if selector.stop is None
+                                                          else selector.stop])
+                targets = positions[first:last]
+                local = targets - start
+            else:
+                local = np.minimum(np.searchsorted(selector, positions), len(selector) - 1)
+                hit = selector[local] == positions
+                targets = positions[hit]
+                local = local[hit]
+            if len(targets):
+                values = np.empty(len(targets), dtype=block.values.dtype)
+                generator.generate_at(tick, t, local, values)
+                block.values[targets] = values
+        return positions
+
+    def changed_addresses(self, name):
+        # Addresses changed by the last update of table name, or None when
+        # the whole table may have changed.
+        positions = self.changed[name]
+        return None if positions is None else self.blocks()[name].addresses_at(positions)
+
+    def close(self):
+        if self.replay is not None:
+            self.replay.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            log.info("Recorded %d frame(s), %d bytes to %s", self.recorder.frames,
+                     self.recorder.bytes, self.recorder.path)
+
+    def capture_state(self):
+        # Everything needed to resume this device: the published tables,
+        # tick counters, injections, held client writes and generator state.
+        # Call between ticks (on the update thread, or when it is stopped).
+        if self.plan is None or self.plan_mode != self.word_mode:
+            self.build_plan()
+        state = {"tick": self.store.current.tick, "ticks": dict(self.ticks),
+                 "tables": {}, "injections": {}, "held": {}, "generators": {}}
+        for name, block in self.blocks().items():
+            state["tables"][name] = {"segments": [list(segment) for segment in block.segments],
+                                     "values": self.store.current.tables[name].copy()}
+            items = self.injections[name]
+            items = items.copy_items()[1] if hasattr(items, "copy_items") else list(items.items())
+            state["injections"][name] = {
+                "addresses": np.array([address for address, _ in items], dtype=np.int64),
+                "values": np.array([int(value) for _, value in items], dtype=np.int64),
+            }
+            if block.held is not None:
+                state["held"][name] = {"mask": block.held.copy(), "values": block.held_values.copy()}
+            state["generators"][name] = [entry[2].get_state() for entry in self.plan[name]]
+        if self.change_rng is not None:
+            state["change_rng"] = self.change_rng.bit_generator.state
+        if self.scenario is not None:
+            state["scenario"] = self.scenario.get_state()
+        return state
+
+    def restore_state(self, state):
+        # Resume from capture_state() output, before the device is served.
+        # Tables whose layout changed since the save are left as generated.
+        if self.plan is None or self.plan_mode != self.word_mode:
+            self.build_plan()
+        for name, block in self.blocks().items():
+            table = state["tables"].get(name)
+            if table is None or [tuple(segment) for segment in table["segments"]] != block.segments:
+                log.warning("Not restoring the %s table of %s: its layout changed", name,
+                            "%s:%s/%s" % (self.config.ip, self.config.port, self.config.slave_id))
+                continue
+            np.copyto(block.values, table["values"])
+            self.ticks[name] = state["ticks"].get(name, 0)
+            injections = state["injections"].get(name)
+            if injections is not None and len(injections["addresses"]):
+                self.injections[name].update(zip(injections["addresses"].tolist(),
+                                                 injections["values"].tolist()))
+            held = state["held"].get(name)
+            if held is not None and block.held is not None:
+                block.held[:] = held["mask"]
+                block.held_values[:] = held["values"]
+                block.held_since.fill(time.monotonic())
+                block._held_stale = True
+            generators = state["generators"].get(name, [])
+            if len(generators) == len(self.plan[name]):
+                for entry, generator_state in zip(self.plan[name], generators):
+                    entry[2].set_state(generator_state)
+        if self.change_rng is not None and "change_rng" in state:
+            self.change_rng.bit_generator.state = state["change_rng"]
+        if self.scenario is not None and "scenario" in state:
+            self.scenario.set_state(state["scenario"])
+        self.store.current.tick = state.get("tick", 0)
+        self.store.touch()
+
+    def release_writes(self):
+        # Hand every client-written address back to the generators.
+        for block in self.blocks().values():
+            block.release_writes()
+
+    def build_plan(self):
+        # The word mode sets a whole-table generator per table; the
+        # configured per-range generators then overwrite their ranges.
+        # plan: {table: [(block, selector, generator, buffer)]} where
+        # selector is a slice, or an index array with a scatter buffer.
+        mode = self.word_mode
+        config = self.config
+        bits = {"type": "constant", "value": 0} if mode == "inject" else {"type": "random"}
+        if mode == "random":
+            words = {"type": "random"}
+        elif mode == "incremental":
+            words = {"type": "incremental", "base": config.increment_start,
+                     "step": config.increment_step}
+        else:
+            words = {"type": "constant", "value": 0}
+
+        plan = {}
+        for name, block in self.blocks().items():
+            dtype = block.values.dtype
+            spec = bits if dtype == BIT else words
+            rngs = [np.random.default_rng(s) for s in
+                    self.seed_sequence.spawn(1 + len(config.generators.get(name, ())))]
+            entries = plan[name] = []
+            entries.append((block, slice(None), create_generator(spec, len(block.values), dtype, rngs[0]), None))
+            for spec, rng in zip(config.generators.get(name, ()), rngs[1:]):
+                selector, size = range_selector(block, spec["start"], spec["count"])
+                if size == 0:
+                    log.warning("%s generator range %s+%s is outside the %s table",
+                                spec["type"], spec["start"], spec["count"], name)
+                    continue
+                buffer = None if isinstance(selector, slice) else np.empty(size, dtype=dtype)
+                entries.append((block, selector, create_generator(spec, size, dtype, rng), buffer))
+        self.plan = plan
+        self.plan_mode = mode
+
+
+def _injection_map(injections, name):
+    mapping = injections.get(name)
+    return InjectionMap() if mapping is None else mapping
+
+
+def _copy_injections(injections):
+    return {table: InjectionMap(dict(mapping)) for table, mapping in injections.items()}
+
+
+def range_selector(block, start, count):
+    # (selector, size) for the addresses [start, start + count) present in
+    # the block: a slice when they are stored contiguously, else an index
+    # array.
+    positions, mask = block.offsets(np.arange(start, start + count))
+    positions = positions[mask]
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return slice(int(positions[0]), int(positions[-1]) + 1), len(positions)
+    return positions, len(positions)
+
+
+class Simulator(object):
+    # Hosts any number of SimDevices in one process. Devices that share an
+    # ip/port are served as separate unit IDs behind one server, and a single
+    # scheduler thread drives every device's updates at its own interval.
+    # serve_forever() blocks until stop() is called from another thread.
+
+    def __init__(self, configs, injections=None):
+        # configs: SimConfigs, or ready-made SimDevices. injections are
+        # the initial injections of every device: a single device uses the
+        # maps passed in (the GUI keeps editing them), several get a copy
+        # each, so a command for one device does not change the others.
+        if not isinstance(configs, (list, tuple)):
+            configs = [configs]
+        copy = injections and len(configs) > 1
+        self.devices = [config if isinstance(config, SimDevice)
+                        else SimDevice(config, _copy_injections(injections) if copy else injections)
+                        for config in configs]
+        self.metrics = Metrics()
+        self.metrics_server = None
+        # Served requests, traced while enabled (config or control API).
+        self.request_trace = RequestTrace()
+        # Control commands run on the update thread before each tick.
+        self.commands = CommandQueue(self.devices, self.request_trace)
+        self.control_server = None
+
+        # One scheduler task per device and distinct table interval.
+        # Plant-wide settings are taken from the first device's config.
+        first = self.devices[0].config if self.devices else None
+        self.scheduler = TickScheduler(first.scheduler_policy if first else DEFAULT_POLICY,
+                                       first.scheduler_spin if first else 0.0,
+                                       on_tick=self._on_tick, before_tick=self.commands.drain)
+        for device in self.devices:
+            for interval, tables in device.schedule_groups().items():
+                self.scheduler.add("%s:%s/%s %s" % (device.config.ip, device.config.port,
+                                                    device.config.slave_id, ",".join(tables)),
+                                   interval, functools.partial(device.update_registers, tables))
+        self.metrics.scheduler = self.scheduler
+
+        # Warm restart from the state file, then keep it up to date.
+        self.state_saver = None
+        if first is not None and first.state_file:
+            if first.state_restore:
+                restore_devices(self.devices, first.state_file)
+            self.state_saver = StateSaver(self.devices, first.state_file, first.state_interval)
+        self.stop_event = threading.Event()
+        self.servers = []
+        self.update_thread = None
+        self._server_lock = threading.Lock()
+
+        # One server context per endpoint: {(ip, port): (engine, context)}.
+        # Server options come from the endpoint's first device.
+        slaves = {}
+        engines = {}
+        self.endpoint_configs = {}
+        for device in self.devices:
+            endpoint = (device.config.ip, device.config.port)
+            slaves.setdefault(endpoint, {})[device.config.slave_id] = device.context
+            engines.setdefault(endpoint, device.config.engine)
+            self.endpoint_configs.setdefault(endpoint, device.config)
+        self.endpoints = {
+            endpoint: (engines[endpoint], ModbusServerContext(slaves=contexts, single=False))
+            for endpoint, contexts in slaves.items()
+        }
+
+    def run_update_loop(self):
+        self.scheduler.run(self.stop_event)
+        for report in self.scheduler.report():
+            log.info("Task %s: %.2f Hz of %.2f, jitter %.6fs, %d overrun(s), %d skipped, "
+                     "%d failed", report["task"], report["achieved_hz"], report["target_hz"] or 0.0,
+                     report["jitter"], report["overruns"], report["skipped"], report["failures"])
+
+    def _on_tick(self, task, duration, lateness):
+        self.metrics.observe_tick(duration, lateness, task.interval)
+        if task is self.scheduler.tasks[0]:
+            log.info("Updated registers at %s", time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def serve_forever(self):
+        self.update_thread = threading.Thread(target=self.run_update_loop)
+        self.update_thread.daemon = True
+        self.update_thread.start()
+        if self.state_saver is not None:
+            self.state_saver.start()
+        threads = []
+        try:
+            with self._server_lock:
+                if self.stop_event.is_set():
+                    return
+                self.start_metrics_server()
+                self.start_control_server()
+                self.start_request_trace()
+                for (ip, port), (engine, context) in self.endpoints.items():
+                    try:
+                        server = create_server(engine, context, (ip, port), self.metrics,
+                                               self.endpoint_configs[(ip, port)].max_inflight,
+                                               self.request_trace)
+                    except Exception as e:
+                        log.error("Server error on %s:%s: %s", ip, port, e)
+                        continue
+                    self.servers.append(server)
+                    thread = threading.Thread(target=self._serve, args=(server, ip, port))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+            # Stop once every server has exited on its own (e.g. bind errors).
+            while threads and not self.stop_event.is_set():
+                threads = [t for t in threads if t.is_alive()]
+                self.stop_event.wait(0.5)
+        finally:
+            self.stop_event.set()
+            self.update_thread.join()
+            if self.state_saver is not None:
+                self.state_saver.stop()
+            self.request_trace.disable()
+            for device in self.devices:
+                device.close()
+
+    def start_metrics_server(self):
+        # Plant-wide settings are taken from the first device's config.
+        config = self.devices[0].config if self.devices else None
+        if config is None or config.metrics_port is None:
+            return
+        from sim_http import MetricsServer
+        try:
+            self.metrics_server = MetricsServer(self.metrics, (config.metrics_ip, config.metrics_port))
+        except OSError as e:
+            log.error("Metrics server error on %s:%s: %s", config.metrics_ip, config.metrics_port, e)
+            return
+        self.metrics_server.start()
+        log.info("Metrics on http://%s:%s/metrics", config.metrics_ip, config.metrics_port)
+
+    def start_control_server(self):
+        # Plant-wide settings are taken from the first device's config.
+        config = self.devices[0].config if self.devices else None
+        if config is None or config.control_port is None:
+            return
+        from sim_http import ControlServer
+        try:
+            self.control_server = ControlServer(self.commands, (config.control_ip, config.control_port))
+        except OSError as e:
+            log.error("Control server error on %s:%s: %s", config.control_ip, config.control_port, e)
+            return
+        self.control_server.start()
+        log.info("Control API on http://%s:%s/commands", config.control_ip, config.control_port)
+
+    def start_request_trace(self):
+        # Plant-wide settings are taken from the first device's config.
+        config = self.devices[0].config if self.devices else None
+        if config is None or not config.request_trace:
+            return
+        try:
+            self.request_trace.enable(config.request_trace)
+        except OSError as e:
+            log.error("Cannot trace requests to %s: %s", config.request_trace, e)
+
+    def _serve(self, server, ip, port):
+        try:
+            server.serve_forever()
+        except Exception as e:
+            log.error("Server error on %s:%s: %s", ip, port, e)
+
+    def release_writes(self):
+        for device in self.devices:
+            device.release_writes()
+
+    def stop(self):
+        with self._server_lock:
+            self.stop_event.set()
+            servers = self.servers
+            self.servers = []
+            metrics_server = self.metrics_server
+            self.metrics_server = None
+            control_server = self.control_server
+            self.control_server = None
+        if metrics_server:
+            metrics_server.stop()
+        if control_server:
+            control_server.stop()
+        if servers:
+            log.info("Stopping Modbus server...")
+        for server in servers:
+            server.shutdown()
+            server.server_close()
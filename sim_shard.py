@@ -0,0 +1,317 @@
+import dataclasses
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+from sim_config import TABLES
+from sim_datastore import BIT, WORD, SnapshotStore, create_block
+from sim_logging import DEFAULT_LOG_RATE, setup_logging
+from sim_server import SimDevice, Simulator
+
+log = logging.getLogger(__name__)
+
+# Images in each device's ring, as for SnapshotStore.
+STORE_DEPTH = 3
+
+# Header slots (int64) of a device's shared memory segment.
+CURRENT = 0                         # index of the published image
+TICK = 1                            # tick of the published image
+INJECTION_VERSION = 2               # + table index
+INJECTION_COUNT = 2 + len(TABLES)   # + table index
+GENERATION = 2 + 2 * len(TABLES)    # + image index
+
+
+def _dtype(name):
+    return BIT if name in ("coils", "discrete") else WORD
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class SharedDeviceMemory(object):
+    # One shared memory segment holding everything about a device that the
+    # supervisor shares with its worker process:
+    #
+    #   header      int64 slots, see CURRENT .. GENERATION
+    #   images      STORE_DEPTH register images, one array per table
+    #   injections  per table a bool mask and a value array
+    #
+    # The layout follows from the config alone, so both sides map the same
+    # arrays onto the buffer without exchanging anything but its name.
+
+    def __init__(self, config, name=None, create=False, depth=STORE_DEPTH):
+        self.config = config
+        self.depth = depth
+        sizes = {table: sum(count for _, count in config.tables[table].segments)
+                 for table in TABLES}
+        header_size = 8 * (GENERATION + depth)
+        offsets = []
+        offset = header_size
+        for _ in range(depth + 2):
+            for table in TABLES:
+                offsets.append(offset)
+                offset = _align(offset + sizes[table] * np.dtype(_dtype(table)).itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=offset)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self.header = np.ndarray(GENERATION + depth, dtype=np.int64, buffer=buf)
+        if create:
+            self.header.fill(0)
+        arrays = iter(offsets)
+
+        def arrays_for(dtype_of):
+            return {table: np.ndarray(sizes[table], dtype=dtype_of(table), buffer=buf,
+                                      offset=next(arrays)) for table in TABLES}
+
+        self.images = [arrays_for(_dtype) for _ in range(depth)]
+        masks = arrays_for(lambda table: np.bool_)
+        values = arrays_for(_dtype)
+        self.injections = {
+            table: SharedInjectionTable(self, index, config.tables[table].segments,
+                                        masks[table], values[table])
+            for index, table in enumerate(TABLES)
+        }
+
+    def create_store(self, blocks):
+        # store_factory for SimDevice: the worker's ring lives in this segment.
+        return SharedSnapshotStore(blocks, self)
+
+    def read(self, table, start, stop):
+        # Seqlock read of the published image, as SnapshotStore.read().
+        header = self.header
+        while True:
+            index = int(header[CURRENT])
+            generation = int(header[GENERATION + index])
+            values = self.images[index][table][start:stop].tolist()
+            if not generation & 1 and header[GENERATION + index] == generation:
+                return values
+
+    def snapshot(self):
+        # (tick, {table: array copy}) of one published image.
+        header = self.header
+        while True:
+            index = int(header[CURRENT])
+            generation = int(header[GENERATION + index])
+            tick = int(header[TICK])
+            tables = {table: values.copy() for table, values in self.images[index].items()}
+            if not generation & 1 and header[GENERATION + index] == generation:
+                return tick, tables
+
+    def close(self):
+        # Drop the array views before closing the mapping; views still held
+        # elsewhere keep it mapped until they are released.
+        self.header = self.images = self.injections = None
+        try:
+            self.shm.close()
+        except BufferError:
+            log.debug("Shared memory %s still in use", self.name)
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedSnapshotStore(SnapshotStore):
+    # SnapshotStore whose ring images live in a SharedDeviceMemory. The
+    # current image index and the generations are mirrored into the shared
+    # header so other processes can follow the seqlock.
+
+    def __init__(self, blocks, memory):
+        self.memory = memory
+        SnapshotStore.__init__(self, blocks, depth=memory.depth)
+
+    def _new_table(self, index, name, block):
+        return self.memory.images[index][name]
+
+    def _set_generation(self, index, generation):
+        SnapshotStore._set_generation(self, index, generation)
+        self.memory.header[GENERATION + index] = generation
+
+    def publish(self):
+        SnapshotStore.publish(self)
+        header = self.memory.header
+        header[TICK] = self.current.tick
+        header[CURRENT] = self._index
+
+
+class SharedInjectionTable(object):
+    # Injections of one table kept as a position mask and values in shared
+    # memory. The supervisor edits them like an InjectionMap; in the worker
+    # the datablock sees the same version/copy_items() interface and
+    # recompiles its overlay when the version changes.
+
+    def __init__(self, memory, index, segments, mask, values):
+        self.memory = memory
+        self.index = index
+        self.mask = mask
+        self.values = values
+        # Address <-> position mapping of the table's layout.
+        self._layout = create_block(segments, values.dtype)
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return int(self.memory.header[INJECTION_VERSION + self.index])
+
+    def __len__(self):
+        return int(self.memory.header[INJECTION_COUNT + self.index])
+
+    def _changed(self):
+        header = self.memory.header
+        header[INJECTION_COUNT + self.index] = np.count_nonzero(self.mask)
+        header[INJECTION_VERSION + self.index] += 1
+
+    def _positions(self, addresses):
+        positions, in_range = self._layout.offsets(addresses)
+        return positions[in_range], in_range
+
+    def __setitem__(self, address, value):
+        self.set_range(address, 1, value)
+
+    def set_range(self, start, count, value):
+        positions, in_range = self._positions(np.arange(start, start + count))
+        if isinstance(value, (list, tuple, np.ndarray)):
+            value = np.asarray(value, dtype=np.int64)[in_range]
+        value = np.asarray(value, dtype=np.int64)
+        with self._lock:
+            if self.values.dtype == BIT:
+                self.values[positions] = value != 0
+            else:
+                self.values[positions] = value & 0xFFFF
+            self.mask[positions] = True
+            self._changed()
+
+    def update(self, mapping):
+        with self._lock:
+            for address, value in mapping.items():
+                positions, _ = self._positions([address])
+                self.values[positions] = (value != 0) if self.values.dtype == BIT else value & 0xFFFF
+                self.mask[positions] = True
+            self._changed()
+
+    def clear_range(self, start, count):
+        positions, _ = self._positions(np.arange(start, start + count))
+        with self._lock:
+            self.mask[positions] = False
+            self._changed()
+
+    def clear(self):
+        with self._lock:
+            self.mask.fill(False)
+            self._changed()
+
+    def copy_items(self):
+        # (version, [(address, value), ...]) for NumpyDataBlock.inject().
+        version = self.version
+        positions = np.flatnonzero(self.mask)
+        addresses = [self._layout.address_at(int(p)) for p in positions]
+        return version, list(zip(addresses, self.values[positions].tolist()))
+
+
+def assign_workers(configs, workers):
+    # Split the configs into at most `workers` groups. Ports are the unit of
+    # sharding (a listening socket belongs to one process); the endpoints
+    # with the most slaves are placed first, each on the least loaded worker.
+    endpoints = {}
+    for config in configs:
+        endpoints.setdefault((config.ip, config.port), []).append(config)
+    groups = [[] for _ in range(max(1, min(workers, len(endpoints))))]
+    for devices in sorted(endpoints.values(), key=len, reverse=True):
+        min(groups, key=len).extend(devices)
+    return groups
+
+
+def _worker_main(index, configs, names, stop_event, log_level, log_levels, log_rate):
+    # Entry point of a worker process: serve its devices until stop_event.
+    # Ctrl-C reaches the whole process group; only the supervisor handles it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(log_level, log_levels, log_rate,
+                  fmt="%%(asctime)s %%(levelname)s worker-%d %%(name)s: %%(message)s" % index)
+    memories = [SharedDeviceMemory(config, name=name) for config, name in zip(configs, names)]
+    devices = [SimDevice(config, injections=memory.injections, store_factory=memory.create_store)
+               for config, memory in zip(configs, memories)]
+    simulator = Simulator(devices)
+    thread = threading.Thread(target=simulator.serve_forever)
+    thread.start()
+    while thread.is_alive() and not stop_event.wait(0.5):
+        pass
+    simulator.stop()
+    thread.join()
+    # The stores reference the shared arrays until the devices are gone.
+    del simulator, devices
+    gc.collect()
+    for memory in memories:
+        memory.close()
+
+
+class ShardedSimulator(object):
+    # Supervisor for a simulator spread over worker processes, one Simulator
+    # each, so generation and request handling use more than one core. The
+    # register images and injections of every device live in shared memory
+    # owned by the supervisor: `devices` gives direct read (read/snapshot)
+    # and injection access without copying through the workers.
+    #
+    # With metrics_port or control_port set, worker i serves its metrics or
+    # control API on that port + i, and request_trace gets the suffix ".i".
+    # Workers log like the supervisor: its root level, plus log_levels and
+    # log_rate as for sim_logging.setup_logging().
+
+    def __init__(self, configs, workers=None, log_levels=None, log_rate=DEFAULT_LOG_RATE):
+        if not isinstance(configs, (list, tuple)):
+            configs = [configs]
+        self.groups = assign_workers(configs, workers or os.cpu_count() or 1)
+        self.memories = {}
+        for group in self.groups:
+            for config in group:
+                self.memories[id(config)] = SharedDeviceMemory(config, create=True)
+        self.devices = [self.memories[id(config)] for config in configs]
+        self.log_levels = log_levels
+        self.log_rate = log_rate
+        self._context = multiprocessing.get_context("spawn")
+        self.stop_event = self._context.Event()
+        self.processes = []
+
+    def serve_forever(self):
+        log_level = logging.getLogger().getEffectiveLevel()
+        try:
+            for index, group in enumerate(self.groups):
+                if self.stop_event.is_set():
+                    break
+                group = list(group)
+                if group[0].metrics_port is not None:
+                    group[0] = dataclasses.replace(group[0], metrics_port=group[0].metrics_port + index)
+                if group[0].control_port is not None:
+                    group[0] = dataclasses.replace(group[0], control_port=group[0].control_port + index)
+                if group[0].request_trace:
+                    group[0] = dataclasses.replace(group[0],
+                                                   request_trace="%s.%d" % (group[0].request_trace, index))
+                names = [self.memories[id(config)].name for config in self.groups[index]]
+                process = self._context.Process(target=_worker_main, name="sim-worker-%d" % index,
+                                                args=(index, group, names, self.stop_event, log_level,
+                                                      self.log_levels, self.log_rate))
+                process.start()
+                self.processes.append(process)
+                log.info("Worker %d (pid %d): %d device(s) on port(s) %s", index, process.pid,
+                         len(group), ", ".join(sorted({str(c.port) for c in group})))
+            while not self.stop_event.wait(0.5):
+                if not any(process.is_alive() for process in self.processes):
+                    break
+        finally:
+            self.stop_event.set()
+            for process in self.processes:
+                process.join(10)
+                if process.is_alive():
+                    log.warning("Terminating unresponsive worker %s", process.name)
+                    process.terminate()
+                    process.join()
+            for memory in self.memories.values():
+                memory.close()
+                memory.unlink()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,210 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# State files: MAGIC, u32 metadata length, JSON metadata, then the arrays
+# it references, each 8-byte aligned. Arrays appear in the metadata as
+# {"array": offset, "dtype": "...", "count": n} (offsets from the first
+# 8-byte boundary after the metadata), so a restore maps the file and
+# copies every table out of it with one memcpy:
+#
+#   {"saved_at": ..., "devices": {"ip:port/slave": {
+#       "ticks": {table: n}, "tables": {table: {"segments": ..., "values": array}},
+#       "injections": {table: {"addresses": array, "values": array}},
+#       "held": {table: {"mask": array, "values": array}},
+#       "generators": {table: [state, ...]}}}}
+MAGIC = b"MBSTATE1"
+_PREFIX = struct.Struct("<8sI")
+
+
+class StateError(ValueError):
+    pass
+
+
+def device_key(config):
+    return "%s:%s/%s" % (config.ip, config.port, config.slave_id)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_state(path, states):
+    # Write {device key: state} (see SimDevice.capture_state) atomically:
+    # a temporary file is renamed over path once complete.
+    arrays = []
+    array_offsets = []
+    position = [0]
+
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            arrays.append(array)
+            array_offsets.append(position[0])
+            position[0] = _align(position[0] + array.nbytes)
+            return {"array": array_offsets[-1], "dtype": array.dtype.str, "count": len(array)}
+        if isinstance(value, dict):
+            return {key: encode(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [encode(item) for item in value]
+        return value
+
+    metadata = {"saved_at": time.time(), "devices": encode(states)}
+    text = json.dumps(metadata).encode()
+    base = _align(_PREFIX.size + len(text))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, len(text)))
+        f.write(text)
+        for array, offset in zip(arrays, array_offsets):
+            f.seek(base + offset)
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return base + position[0]
+
+
+class StateFile(object):
+    # A state file mapped read-only; the arrays in `devices` are views of the
+    # mapping.
+    # Use as a context manager and copy what you need before it closes.
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, length = _PREFIX.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise KeyError(magic)
+            self.metadata = json.loads(bytes(self._map[_PREFIX.size:_PREFIX.size + length]))
+            self._base = _align(_PREFIX.size + length)
+            self.devices = self.decode(self.metadata["devices"])
+        except (ValueError, struct.error, KeyError, TypeError):
+            self.close()
+            raise StateError("%s is not a simulator state file" % path)
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            if "array" in value and "dtype" in value and len(value) == 3:
+                return np.frombuffer(self._map, dtype=np.dtype(value["dtype"]),
+                                     count=value["count"], offset=self._base + value["array"])
+            return {key: self.decode(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+    def close(self):
+        self.devices = None
+        if getattr(self, "_map", None) is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Views are still referenced; the mapping goes with them.
+                pass
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StateSaver(object):
+    # Saves the state of a Simulator's devices every `interval` seconds and
+    # on shutdown. Capturing (a copy of each table and of the generator
+    # state) runs on the update thread right after a device's tick, so it
+    # never races generation; encoding and disk writes run on the saver's
+    # own thread and never stall ticks.
+
+    def __init__(self, devices, path, interval):
+        self.devices = devices
+        self.path = path
+        self.interval = interval
+        self.saves = 0
+        self._captured = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="state-saver")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                self._captured = {}
+                self._ready.clear()
+            for device in self.devices:
+                device.capture_requested = self
+            # Devices deliver after their next tick; give slow ones one
+            # interval before saving what has arrived.
+            self._ready.wait(self.interval)
+            with self._lock:
+                states = dict(self._captured)
+            for device in self.devices:
+                device.capture_requested = None
+            if self._stop.is_set():
+                return
+            self._write(states)
+
+    def deliver(self, device, state):
+        # Called by a device on the update thread with its captured state.
+        with self._lock:
+            self._captured[device_key(device.config)] = state
+            if len(self._captured) == len(self.devices):
+                self._ready.set()
+
+    def _write(self, states):
+        started = time.perf_counter()
+        try:
+            size = write_state(self.path, states)
+        except (OSError, ValueError) as e:
+            log.error("Cannot save state to %s: %s", self.path, e)
+            return
+        self.saves += 1
+        log.debug("Saved state of %d device(s), %d bytes to %s in %.3fs", len(states), size,
+                  self.path, time.perf_counter() - started)
+
+    def stop(self):
+        # Final save once the update loop has stopped (no ticks running).
+        self._stop.set()
+        self._ready.set()
+        if self._thread is not None:
+            self._thread.join()
+        for device in self.devices:
+            device.capture_requested = None
+        self._write({device_key(device.config): device.capture_state() for device in self.devices})
+        log.info("Saved simulator state to %s", self.path)
+
+
+def restore_devices(devices, path):
+    # Restore every device found in the state file at path. Returns the
+    # number of devices restored; a missing file restores nothing.
+    if not os.path.exists(path):
+        return 0
+    started = time.perf_counter()
+    restored = 0
+    with StateFile(path) as state_file:
+        for device in devices:
+            state = state_file.devices.get(device_key(device.config))
+            if state is not None:
+                device.restore_state(state)
+                restored += 1
+    log.info("Restored %d device(s) from %s in %.1f ms", restored, path,
+             (time.perf_counter() - started) * 1000)
+    return restored
@@ -0,0 +1,303 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+from sim_datastore import BIT, WORD
+
+# Register trace files: a header describing the tables, then one frame per
+# recorded tick. All integers are little endian.
+#
+#   header: MAGIC, u16 version, u8 table count, then per table
+#           u8 name length, name, u8 kind (0 bits, 1 words),
+#           u32 segment count, (u32 start, u32 count) per segment
+#   frame:  u32 payload length, f64 time (seconds), u8 frame kind,
+#           then one record per table in header order:
+#           key frame    bits: packed bits (np.packbits), words: u16 values
+#           delta frame  u32 n, u32 positions[n], values[n] (u8 bits, u16 words)
+#
+# Key frames are written every KEYFRAME_INTERVAL frames and whenever a
+# delta would be larger, so a trace of mostly static registers costs a few
+# bytes per changed value per tick.
+MAGIC = b"MBTRACE1"
+VERSION = 1
+KEY_FRAME = 0
+DELTA_FRAME = 1
+KEYFRAME_INTERVAL = 1000
+
+_HEADER = struct.Struct("<8sHB")
+_TABLE = struct.Struct("<BI")
+_SEGMENT = struct.Struct("<II")
+_FRAME = struct.Struct("<IdB")
+_COUNT = struct.Struct("<I")
+
+_DTYPES = {0: BIT, 1: WORD}
+
+
+class TraceError(ValueError):
+    pass
+
+
+class TraceRecorder(object):
+    # Appends register images to a trace file, one frame per record() call.
+
+    def __init__(self, path, blocks, keyframe_interval=KEYFRAME_INTERVAL):
+        # blocks: {name: NumpyDataBlock}; their segments and dtypes make
+        # the header.
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.names = list(blocks)
+        self.frames = 0
+        self.bytes = 0
+        self._previous = None
+        self._file = open(path, "wb")
+        header = [_HEADER.pack(MAGIC, VERSION, len(self.names))]
+        for name, block in blocks.items():
+            encoded = name.encode()
+            header.append(bytes([len(encoded)]) + encoded)
+            header.append(_TABLE.pack(0 if block.values.dtype == BIT else 1, len(block.segments)))
+            header.extend(_SEGMENT.pack(start, count) for start, count in block.segments)
+        self._write(b"".join(header))
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes += len(data)
+
+    def record(self, t, tables, changed=None):
+        # tables: {name: array} of one published image at time t (seconds).
+        # changed: optional {name: sorted positions that may differ from the
+        # previous image, or None for any}, so sparse updates are recorded
+        # without comparing whole tables.
+        changed = changed or {}
+        previous = self._previous
+        records = None
+        if previous is not None and self.frames % self.keyframe_interval:
+            records = self._delta(tables, previous, changed)
+        kind = DELTA_FRAME
+        if records is None:
+            records = [self._key(tables[name]) for name in self.names]
+            kind = KEY_FRAME
+        payload = b"".join(records)
+        self._write(_FRAME.pack(len(payload), t, kind) + payload)
+        if previous is None:
+            self._previous = {name: tables[name].copy() for name in self.names}
+        else:
+            for name in self.names:
+                positions = changed.get(name)
+                if positions is None or kind == KEY_FRAME:
+                    np.copyto(previous[name], tables[name])
+                else:
+                    previous[name][positions] = tables[name][positions]
+        self.frames += 1
+
+    def _key(self, values):
+        if values.dtype == BIT:
+            return np.packbits(values).tobytes()
+        return values.astype("<u2").tobytes()
+
+    def _delta(self, tables, previous, changed):
+        # Delta records, or None when a key frame would be smaller.
+        records = []
+        size = 0
+        key_size = 0
+        for name in self.names:
+            values = tables[name]
+            positions = changed.get(name)
+            if positions is None:
+                positions = np.flatnonzero(values != previous[name])
+            else:
+                positions = positions[values[positions] != previous[name][positions]]
+            if values.dtype == BIT:
+                data = values[positions].astype(np.uint8).tobytes()
+                key_size += (len(values) + 7) // 8
+            else:
+                data = values[positions].astype("<u2").tobytes()
+                key_size += 2 * len(values)
+            record = _COUNT.pack(len(positions)) + positions.astype("<u4").tobytes() + data
+            size += len(record)
+            records.append(record)
+        return records if size < key_size else None
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class TraceTable(object):
+    # One table of a trace: its layout and current values.
+
+    def __init__(self, name, dtype, segments):
+        self.name = name
+        self.dtype = dtype
+        self.segments = segments
+        self.size = sum(count for _, count in segments)
+        self.values = np.zeros(self.size, dtype=dtype)
+
+    def addresses(self):
+        if not self.segments:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, start + count) for start, count in self.segments])
+
+
+class TraceReader(object):
+    # Streams the frames of a trace file through a read-only memory map:
+    # only the frames applied so far are touched, and values are decoded
+    # straight from the mapped pages. advance(t) applies every frame up to
+    # trace time t to the tables' current values.
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise TraceError("%s is empty" % path)
+        self.tables = {}
+        try:
+            self._first = self._read_header()
+        except (struct.error, IndexError, KeyError, UnicodeDecodeError):
+            self.close()
+            raise TraceError("%s is not a register trace" % path)
+        self.rewind()
+
+    def _read_header(self):
+        magic, version, count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise KeyError(magic)
+        offset = _HEADER.size
+        for _ in range(count):
+            length = self._map[offset]
+            name = self._map[offset + 1:offset + 1 + length].decode()
+            offset += 1 + length
+            kind, segment_count = _TABLE.unpack_from(self._map, offset)
+            offset += _TABLE.size
+            segments = [_SEGMENT.unpack_from(self._map, offset + i * _SEGMENT.size)
+                        for i in range(segment_count)]
+            offset += segment_count * _SEGMENT.size
+            self.tables[name] = TraceTable(name, _DTYPES[kind], segments)
+        return offset
+
+    def rewind(self):
+        self._offset = self._first
+        self.time = None
+        self.frames = 0
+        for table in self.tables.values():
+            table.values.fill(0)
+
+    def peek_time(self):
+        # Time of the next frame, or None at the end of the trace.
+        if self._offset + _FRAME.size > len(self._map):
+            return None
+        return _FRAME.unpack_from(self._map, self._offset)[1]
+
+    def advance(self, t):
+        # Apply the frames with time <= t; returns the number applied.
+        applied = 0
+        while True:
+            next_time = self.peek_time()
+            if next_time is None or next_time > t:
+                return applied
+            self._apply_frame()
+            applied += 1
+
+    def _apply_frame(self):
+        length, t, kind = _FRAME.unpack_from(self._map, self._offset)
+        offset = self._offset + _FRAME.size
+        end = offset + length
+        if end > len(self._map):
+            # Truncated last frame, e.g. a recorder that was killed.
+            self._offset = len(self._map)
+            return
+        for table in self.tables.values():
+            if kind == KEY_FRAME:
+                if table.dtype == BIT:
+                    size = (table.size + 7) // 8
+                    packed = np.frombuffer(self._map, dtype=np.uint8, count=size, offset=offset)
+                    table.values[:] = np.unpackbits(packed, count=table.size).view(BIT)
+                else:
+                    size = 2 * table.size
+                    table.values[:] = np.frombuffer(self._map, dtype="<u2", count=table.size,
+                                                    offset=offset)
+                offset += size
+            else:
+                n = _COUNT.unpack_from(self._map, offset)[0]
+                offset += _COUNT.size
+                positions = np.frombuffer(self._map, dtype="<u4", count=n, offset=offset)
+                offset += 4 * n
+                if table.dtype == BIT:
+                    table.values[positions] = np.frombuffer(self._map, dtype=np.uint8, count=n,
+                                                            offset=offset) != 0
+                    offset += n
+                else:
+                    table.values[positions] = np.frombuffer(self._map, dtype="<u2", count=n,
+                                                            offset=offset)
+                    offset += 2 * n
+        self._offset = end
+        self.time = t
+        self.frames += 1
+
+    def duration(self):
+        # Time of the last frame; walks the frame headers only.
+        offset = self._first
+        last = 0.0
+        while offset + _FRAME.size <= len(self._map):
+            length, t, _ = _FRAME.unpack_from(self._map, offset)
+            last = t
+            offset += _FRAME.size + length
+        return last
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class TraceReplay(object):
+    # Replays a trace into device blocks. Simulated time t maps to trace
+    # time t * speed; with loop the trace restarts after its last frame.
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.reader = TraceReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.length = self.reader.duration()
+        self._base = 0.0
+        self._mappings = {}
+
+    def advance(self, t):
+        trace_time = t * self.speed - self._base
+        self.reader.advance(trace_time)
+        if self.loop and self.reader.peek_time() is None and trace_time > self.length:
+            # Restart with the trace's first frame at the current time.
+            self._base += trace_time
+            self.reader.rewind()
+            self.reader.advance(0.0)
+
+    def apply(self, name, block):
+        # Copy the replayed values of table name into block.values, matching
+        # addresses; addresses missing from the block are ignored.
+        table = self.reader.tables.get(name)
+        if table is None:
+            return
+        mapping = self._mappings.get(name)
+        if mapping is None or mapping[0] is not block:
+            mapping = self._mappings[name] = (block,) + self._map_addresses(table, block)
+        _, target, source = mapping
+        block.values[target] = table.values[source]
+
+    def _map_addresses(self, table, block):
+        # (target, source) selectors: slices when both layouts match.
+        if table.segments == block.segments:
+            return slice(None), slice(None)
+        positions, mask = block.offsets(table.addresses())
+        return positions[mask], np.flatnonzero(mask)
+
+    def close(self):
+        self.reader.close()
+
+
+def trace_path(pattern, config):
+    # Expand {port} and {slave_id} so every device of a plant gets its own file.
+    return os.path.expanduser(pattern.format(port=config.port, slave_id=config.slave_id))
@@ -0,0 +1,96 @@
+import tkinter as tk
+from tkinter import ttk
+
+# Fallback row height (pixels) when the Treeview style does not set one.
+DEFAULT_ROW_HEIGHT = 20
+
+
+class RegisterTableView(tk.Frame):
+    # Virtualized view of one register table. The Treeview only ever holds
+    # one screenful of rows; scrolling moves a window over the datablock and
+    # refresh() reads just that window from the published image, touching
+    # only the cells whose value changed since the last refresh.
+
+    def __init__(self, master, **kwargs):
+        tk.Frame.__init__(self, master, **kwargs)
+        self.block = None
+        self.first = 0          # position of the top row in block.values
+        self.rows = 1           # number of visible rows
+        self._shown = []        # (address, value) currently in each row
+
+        self.tree = ttk.Treeview(self, columns=("address", "value"), show="headings",
+                                 selectmode="none")
+        self.tree.heading("address", text="Address")
+        self.tree.heading("value", text="Value")
+        self.tree.column("address", width=120, anchor="w")
+        self.tree.column("value", width=120, anchor="w")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+
+    def set_block(self, block):
+        self.block = block
+        self.first = 0
+        self._set_rows(self.rows, force=True)
+
+    def total(self):
+        return len(self.block.values) if self.block is not None else 0
+
+    def scroll(self, delta):
+        self.first = max(0, min(self.first + delta, self.total() - self.rows))
+        self.refresh()
+
+    def refresh(self):
+        # Redraw the visible window from the block's published image.
+        total = self.total()
+        if total == 0:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        self.first = max(0, min(self.first, total - self.rows))
+        last = min(self.first + self.rows, total)
+        if self.block.store is not None:
+            values = self.block.store.read(self.block.name, self.first, last)
+        else:
+            values = self.block.values[self.first:last].tolist()
+        for row, value in enumerate(values):
+            cell = (self.block.address_at(self.first + row), int(value))
+            if self._shown[row] != cell:
+                self._shown[row] = cell
+                self.tree.item(row, values=cell)
+        for row in range(len(values), self.rows):
+            if self._shown[row] is not None:
+                self._shown[row] = None
+                self.tree.item(row, values=("", ""))
+        self.scrollbar.set(self.first / total, last / total)
+
+    def _set_rows(self, rows, force=False):
+        if rows == self.rows and not force:
+            return
+        self.rows = rows
+        self.tree.delete(*self.tree.get_children())
+        for row in range(rows):
+            self.tree.insert("", "end", iid=row, values=("", ""))
+        self._shown = [None] * rows
+        self.refresh()
+
+    def _on_resize(self, event):
+        style = ttk.Style(self)
+        row_height = int(style.lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        # Leave room for the heading row.
+        self._set_rows(max(1, event.height // row_height - 1))
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.first = int(float(amount) * self.total())
+            self.refresh()
+        elif action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            self.scroll(int(amount) * step)
+
+    def _on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)